@@ -6,7 +6,7 @@ import requests
 import json
 import time
 import os
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator
 
 class VLLMAPIClient:
     """vLLM OpenAI 호환 API 클라이언트"""
@@ -20,6 +20,8 @@ class VLLMAPIClient:
             "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
             "Access-Control-Allow-Headers": "*"
         }
+        self._tokenize_retry_at = 0.0  # /tokenize 실패 후 재시도 시각 (그 전까지는 바로 추정치 사용)
+        self._tokenize_fallback_logged = False
     
     def health_check(self) -> bool:
         """서버 상태 확인"""
@@ -83,6 +85,68 @@ class VLLMAPIClient:
         except Exception as e:
             return f"오류: {str(e)}"
     
+    def chat_completion_stream(
+        self,
+        messages: List[Dict[str, str]],
+        model: str = "tuned-model",
+        temperature: float = 0.7,
+        max_tokens: int = 256,
+        **kwargs
+    ) -> Iterator[str]:
+        """채팅 완성 API 스트리밍 호출 (토큰 단위로 yield)"""
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+            **kwargs
+        }
+        
+        try:
+            with requests.post(
+                f"{self.base_url}/v1/chat/completions",
+                headers=self.headers,
+                json=payload,
+                timeout=60,
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data: "):
+                        continue
+                    data = line[len("data: "):]
+                    if data == "[DONE]":
+                        break
+                    delta = json.loads(data)["choices"][0].get("delta", {})
+                    if delta.get("content"):
+                        yield delta["content"]
+        except Exception as e:
+            yield f"오류: {str(e)}"
+    
+    def count_tokens(self, text: str, model: str = "tuned-model") -> int:
+        """서버 토크나이저로 토큰 수 계산 (실패시 UTF-8 바이트 수로 보수적 추정)"""
+        if time.time() < self._tokenize_retry_at:
+            return len(text.encode("utf-8"))
+        
+        try:
+            response = requests.post(
+                f"{self.base_url}/tokenize",
+                headers=self.headers,
+                json={"model": model, "prompt": text, "add_special_tokens": False},
+                timeout=10
+            )
+            response.raise_for_status()
+            return response.json()["count"]
+        except Exception as e:
+            # 실패가 반복되면 호출마다 타임아웃을 기다리지 않도록 잠시 서버 호출 중단
+            self._tokenize_retry_at = time.time() + 60
+            if not self._tokenize_fallback_logged:
+                self._tokenize_fallback_logged = True
+                print(f"⚠️ /tokenize 호출 실패, UTF-8 바이트 수로 토큰 수 추정 (영어 기준 약 4배 과대 추정되어 컨텍스트가 적게 채워집니다): {e}")
+            # Llama 토크나이저는 byte fallback이므로 바이트 수가 상한
+            return len(text.encode("utf-8"))
+    
     def simple_chat(self, user_message: str, system_message: str = "답변하세요.") -> str:
         """간단한 채팅"""
         # 시스템 메시지 없이 사용자 메시지만 사용 (토큰 절약)
@@ -0,0 +1,142 @@
+"""
+토큰 예산 기반 컨텍스트 패커
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Callable
+
+
+class ContextPacker:
+    """서빙 모델 토크나이저 기준 토큰 예산 안에 검색 청크를 채우는 패커
+    
+    - 점수가 높은 청크부터 예산에 들어가는 만큼 그리디하게 채움
+    - 인접 PDF 청크의 오버랩(중복 문장) 제거
+    - 고정된 프롬프트 접두사 + 문서 순서 정렬로 서버 prefix cache 재사용
+    - 토큰 수는 텍스트별로 캐시하고, 캐시에 없는 후보는 한 번에 동시 계산 (서버 /tokenize 사용시)
+    """
+    
+    PROMPT_TEMPLATE = """참고 정보:
+{context}
+
+질문: {query}
+
+답변:"""
+    
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int],
+        max_model_len: int = 2048,   # vLLM --max-model-len
+        max_new_tokens: int = 256,   # chat_completion max_tokens
+        reserved_tokens: int = 32,   # 채팅 템플릿([INST] 등) 및 경계 오차 여유분
+        max_workers: int = 8,        # 토큰 수 동시 계산 스레드 수 (로컬 토크나이저면 1)
+        max_cached_texts: int = 4096
+    ):
+        self.count_tokens = count_tokens
+        self.max_model_len = max_model_len
+        self.max_new_tokens = max_new_tokens
+        self.reserved_tokens = reserved_tokens
+        self.max_workers = max_workers
+        self.max_cached_texts = max_cached_texts
+        self._token_counts: Dict[str, int] = {}
+    
+    def _prefetch_token_counts(self, texts: List[str]):
+        """캐시에 없는 텍스트의 토큰 수를 한 번에 계산 (HTTP 호출이면 순차 대기 대신 동시 전송)"""
+        missing = [text for text in dict.fromkeys(texts) if text not in self._token_counts]
+        if not missing:
+            return
+        
+        if self.max_workers > 1 and len(missing) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing))) as executor:
+                counts = list(executor.map(self.count_tokens, missing))
+        else:
+            counts = [self.count_tokens(text) for text in missing]
+        
+        if len(self._token_counts) + len(missing) > self.max_cached_texts:
+            self._token_counts.clear()
+        self._token_counts.update(zip(missing, counts))
+    
+    def _token_count(self, text: str) -> int:
+        """캐시된 토큰 수 (없으면 계산 후 캐시)"""
+        if text not in self._token_counts:
+            self._prefetch_token_counts([text])
+        return self._token_counts[text]
+    
+    @staticmethod
+    def _context_line(sentences: List[str]) -> str:
+        return "- " + " ".join(sentences) + "\n"
+    
+    def context_budget(self, query: str) -> int:
+        """질문과 템플릿을 제외하고 컨텍스트에 쓸 수 있는 토큰 수"""
+        prompt_tokens = self._token_count(self.PROMPT_TEMPLATE.format(context="", query=query))
+        budget = self.max_model_len - self.max_new_tokens - self.reserved_tokens - prompt_tokens
+        return max(0, budget)
+    
+    @staticmethod
+    def _split_sentences(text: str) -> List[str]:
+        """청킹과 같은 기준('. ')으로 문장 분리"""
+        sentences = []
+        for sentence in text.split('. '):
+            sentence = sentence.strip()
+            if sentence:
+                sentences.append(sentence if sentence.endswith('.') else sentence + '.')
+        return sentences
+    
+    @staticmethod
+    def _normalize(sentence: str) -> str:
+        return ' '.join(sentence.split())
+    
+    @staticmethod
+    def _document_order(metadata: Dict) -> Tuple:
+        """문서 내 위치 기준 정렬 키 (같은 청크 집합이면 항상 같은 프롬프트)"""
+        if metadata.get('source_type') == 'pdf':
+            return (1, metadata.get('filename', ''), metadata.get('chunk_index', 0))
+        return (0, str(metadata.get('source_index', '')), 0)
+    
+    def pack(
+        self,
+        query: str,
+        search_results: List[Tuple[str, Dict, float]]
+    ) -> Tuple[str, List[Tuple[str, Dict, float]]]:
+        """검색 결과를 토큰 예산 안에 채워 (프롬프트, 사용된 결과) 반환"""
+        ranked = sorted(search_results, key=lambda x: x[2], reverse=True)
+        
+        # 템플릿 + 후보 라인(전체 / 모든 청크가 들어간다고 가정한 오버랩 제거본)의 토큰 수를 한 번에 계산
+        candidate_lines = [self.PROMPT_TEMPLATE.format(context="", query=query)]
+        seen_sentences = set()
+        for chunk, _, _ in ranked:
+            sentences = self._split_sentences(chunk)
+            candidate_lines.append(self._context_line(sentences))
+            new_sentences = [s for s in sentences if self._normalize(s) not in seen_sentences]
+            if new_sentences:
+                candidate_lines.append(self._context_line(new_sentences))
+            seen_sentences.update(self._normalize(s) for s in sentences)
+        self._prefetch_token_counts(candidate_lines)
+        
+        remaining = self.context_budget(query)
+        seen_sentences = set()
+        packed = []  # (정렬 키, 컨텍스트 라인, 원본 결과)
+        
+        for chunk, metadata, score in ranked:
+            # 이미 포함된 문장(인접 청크 오버랩) 제거
+            new_sentences = [
+                s for s in self._split_sentences(chunk)
+                if self._normalize(s) not in seen_sentences
+            ]
+            if not new_sentences:
+                continue
+            
+            line = self._context_line(new_sentences)
+            cost = self._token_count(line)
+            if cost > remaining:
+                # 통째로 들어가지 않는 청크는 자르지 않고 다음 후보로 넘어감
+                continue
+            
+            remaining -= cost
+            seen_sentences.update(self._normalize(s) for s in new_sentences)
+            packed.append((self._document_order(metadata), line, (chunk, metadata, score)))
+        
+        packed.sort(key=lambda x: x[0])
+        context = "".join(line for _, line, _ in packed).rstrip("\n")
+        prompt = self.PROMPT_TEMPLATE.format(context=context, query=query)
+        
+        return prompt, [result for _, _, result in packed]
\ No newline at end of file
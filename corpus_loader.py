@@ -0,0 +1,308 @@
+"""
+대용량 코퍼스 벌크 로더
+- JSONL / Parquet / 디스크의 Hugging Face 데이터셋(또는 Hub 스트리밍)에서 레코드를 스트리밍
+- 고정 크기 배치 단위로 청킹 + 임베딩 후 샤드 파일로 저장
+- 체크포인트로 중단 지점부터 재개, 코퍼스 크기와 무관하게 메모리 일정
+"""
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+from typing import List, Dict, Tuple, Iterator, Optional
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+CHECKPOINT_FILE = "checkpoint.json"
+
+
+def chunk_knowledge_item(item: Dict, chunk_size: int = 300) -> List[Tuple[str, Dict]]:
+    """지식 레코드의 context를 문장 단위 청크로 분할"""
+    chunks = []
+    metadata = {
+        'source_index': item['index'],
+        'user_message': item['user_message'],
+        'response': item['response']
+    }
+    if item.get('dataset'):
+        metadata['dataset'] = item['dataset']
+    
+    # 간단한 청킹 (문장 단위)
+    sentences = item['context'].split('. ')
+    
+    current_chunk = ""
+    for sentence in sentences:
+        if len(current_chunk + sentence) < chunk_size:
+            current_chunk += sentence + ". "
+        else:
+            if current_chunk:
+                chunks.append((current_chunk.strip(), dict(metadata)))
+            current_chunk = sentence + ". "
+    
+    # 마지막 청크 추가
+    if current_chunk:
+        chunks.append((current_chunk.strip(), dict(metadata)))
+    
+    return chunks
+
+
+def normalize_record(record: Dict, index: int, dataset: str = "") -> Optional[Dict]:
+    """고객 지원 데이터셋별 스키마를 지식 레코드 형태로 통일 (context가 없으면 None)
+    
+    - argilla/customer_assistant: user-message / context / response-suggestion
+    - argilla/synthetic-sft-customer-support-single-turn: prompt / completion
+    - bitext/Bitext-customer-support-llm-chatbot-training-dataset: instruction / response
+    """
+    user_message = (
+        record.get('user-message') or record.get('user_message')
+        or record.get('instruction') or record.get('prompt') or ''
+    )
+    response = (
+        record.get('response-suggestion') or record.get('response')
+        or record.get('completion') or ''
+    )
+    context = record.get('context') or record.get('text') or response
+    
+    if not context:
+        return None
+    
+    return {
+        'index': index,
+        'user_message': user_message,
+        'context': context,
+        'response': response,
+        'dataset': dataset
+    }
+
+
+def iter_records(source: str, start: int = 0, read_batch_size: int = 1024) -> Iterator[Dict]:
+    """소스에서 레코드를 하나씩 스트리밍 (start개는 건너뜀)"""
+    if source.endswith('.jsonl'):
+        with open(source, 'r', encoding='utf-8') as f:
+            record_number = 0
+            for line in f:
+                if not line.strip():
+                    continue
+                if record_number >= start:
+                    yield json.loads(line)
+                record_number += 1
+    
+    elif source.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(source)
+        seen = 0
+        for batch in parquet_file.iter_batches(batch_size=read_batch_size):
+            if seen + batch.num_rows <= start:
+                seen += batch.num_rows
+                continue
+            for row in batch.to_pylist()[max(0, start - seen):]:
+                yield row
+            seen += batch.num_rows
+    
+    elif os.path.isdir(source):
+        # save_to_disk로 저장된 데이터셋 (Arrow 메모리 매핑이라 전체를 메모리에 올리지 않음)
+        from datasets import load_from_disk, DatasetDict
+        dataset = load_from_disk(source)
+        if isinstance(dataset, DatasetDict):
+            dataset = dataset['train']
+        for batch_start in range(start, len(dataset), read_batch_size):
+            batch = dataset[batch_start:batch_start + read_batch_size]
+            columns = list(batch.keys())
+            for values in zip(*[batch[column] for column in columns]):
+                yield dict(zip(columns, values))
+    
+    else:
+        # Hugging Face Hub 데이터셋 이름 (스트리밍 모드)
+        from datasets import load_dataset
+        dataset = load_dataset(source, split='train', streaming=True)
+        for record in dataset.skip(start):
+            yield record
+
+
+def _batched(iterator: Iterator, batch_size: int) -> Iterator[List]:
+    batch = []
+    for item in iterator:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BulkCorpusLoader:
+    """코퍼스를 배치 단위로 청킹/임베딩하여 샤드로 저장하는 로더
+    
+    출력 디렉터리 구조:
+        shard_00000.jsonl  - 청크 텍스트 + 메타데이터
+        shard_00000.npy    - 청크 임베딩 (float32)
+        checkpoint.json    - 처리한 레코드 수, 샤드 수, 완료 여부
+    """
+    
+    def __init__(
+        self,
+        embedder,
+        output_dir: str,
+        batch_size: int = 1024,       # 샤드 하나에 들어가는 레코드 수
+        encode_batch_size: int = 64,
+        num_workers: int = 1,
+        device: str = "cpu",
+        chunk_size: int = 300
+    ):
+        self.embedder = embedder
+        self.output_dir = output_dir
+        self.batch_size = batch_size
+        self.encode_batch_size = encode_batch_size
+        self.num_workers = num_workers
+        self.device = device
+        self.chunk_size = chunk_size
+    
+    def _checkpoint_path(self) -> str:
+        return os.path.join(self.output_dir, CHECKPOINT_FILE)
+    
+    def _write_checkpoint(self, checkpoint: Dict):
+        """체크포인트 원자적 저장"""
+        tmp_path = self._checkpoint_path() + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self._checkpoint_path())
+    
+    def _write_shard(self, shard_id: int, chunks: List[Tuple[str, Dict]], embeddings: np.ndarray):
+        """샤드 저장 (임시 파일에 쓴 뒤 교체하여 중단시에도 깨진 샤드가 남지 않음)"""
+        base_path = os.path.join(self.output_dir, f"shard_{shard_id:05d}")
+        
+        with open(base_path + ".jsonl.tmp", 'w', encoding='utf-8') as f:
+            for text, metadata in chunks:
+                f.write(json.dumps({'text': text, 'metadata': metadata}, ensure_ascii=False) + "\n")
+        with open(base_path + ".npy.tmp", 'wb') as f:
+            np.save(f, embeddings.astype('float32'))
+        
+        os.replace(base_path + ".jsonl.tmp", base_path + ".jsonl")
+        os.replace(base_path + ".npy.tmp", base_path + ".npy")
+    
+    def _encode(self, texts: List[str], pool) -> np.ndarray:
+        if pool is not None:
+            return self.embedder.encode_multi_process(texts, pool, batch_size=self.encode_batch_size)
+        return self.embedder.encode(texts, batch_size=self.encode_batch_size)
+    
+    def load(self, source: str) -> Dict:
+        """소스 코퍼스를 샤드로 변환 (기존 체크포인트가 있으면 이어서 진행)"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        checkpoint = read_checkpoint(self.output_dir)
+        
+        if checkpoint['source'] and checkpoint['source'] != source:
+            raise ValueError(
+                f"출력 디렉터리에 다른 소스('{checkpoint['source']}')의 체크포인트가 있습니다."
+            )
+        if checkpoint['completed']:
+            print(f"✅ 이미 완료된 코퍼스입니다: {checkpoint['total_chunks']}개 청크")
+            return checkpoint
+        
+        checkpoint.update({'source': source, 'embedding_model': EMBEDDING_MODEL_NAME})
+        if checkpoint['records_done']:
+            print(f"🔁 체크포인트에서 재개: {checkpoint['records_done']:,}개 레코드 처리됨")
+        
+        dataset_name = os.path.basename(source.rstrip('/'))
+        pool = None
+        if self.num_workers > 1:
+            pool = self.embedder.start_multi_process_pool(target_devices=[self.device] * self.num_workers)
+        
+        start_time = time.time()
+        start_records = checkpoint['records_done']
+        try:
+            records = iter_records(source, start=checkpoint['records_done'])
+            for batch in _batched(records, self.batch_size):
+                chunks = []
+                for offset, record in enumerate(batch):
+                    item = normalize_record(record, checkpoint['records_done'] + offset, dataset_name)
+                    if item is not None:
+                        chunks.extend(chunk_knowledge_item(item, self.chunk_size))
+                
+                if chunks:
+                    encode_start = time.time()
+                    embeddings = self._encode([text for text, _ in chunks], pool)
+                    checkpoint['embedding_seconds'] = checkpoint.get('embedding_seconds', 0.0) + time.time() - encode_start
+                    self._write_shard(checkpoint['shards'], chunks, embeddings)
+                    checkpoint['shards'] += 1
+                    checkpoint['total_chunks'] += len(chunks)
+                    checkpoint['embedding_dim'] = int(embeddings.shape[1])
+                
+                checkpoint['records_done'] += len(batch)
+                self._write_checkpoint(checkpoint)
+                
+                elapsed = time.time() - start_time
+                rate = (checkpoint['records_done'] - start_records) / elapsed if elapsed > 0 else 0.0
+                print(
+                    f"📦 {checkpoint['records_done']:,}개 레코드 / {checkpoint['total_chunks']:,}개 청크 "
+                    f"/ 샤드 {checkpoint['shards']}개 ({rate:,.0f} records/s)"
+                )
+        finally:
+            if pool is not None:
+                self.embedder.stop_multi_process_pool(pool)
+        
+        checkpoint['completed'] = True
+        self._write_checkpoint(checkpoint)
+        print(f"✅ 코퍼스 로드 완료: {checkpoint['total_chunks']:,}개 청크, 샤드 {checkpoint['shards']}개")
+        return checkpoint
+
+
+def read_checkpoint(output_dir: str) -> Dict:
+    """출력 디렉터리의 체크포인트 로드 (없으면 초기 상태)"""
+    checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILE)
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {
+        'source': None,
+        'embedding_model': EMBEDDING_MODEL_NAME,
+        'embedding_dim': None,
+        'records_done': 0,
+        'shards': 0,
+        'total_chunks': 0,
+        'embedding_seconds': 0.0,
+        'completed': False
+    }
+
+
+def iter_shards(output_dir: str) -> Iterator[Tuple[List[str], List[Dict], np.ndarray]]:
+    """저장된 샤드를 순서대로 (청크, 메타데이터, 임베딩) 형태로 반환"""
+    checkpoint = read_checkpoint(output_dir)
+    for shard_id in range(checkpoint['shards']):
+        base_path = os.path.join(output_dir, f"shard_{shard_id:05d}")
+        chunks, metadata = [], []
+        with open(base_path + ".jsonl", 'r', encoding='utf-8') as f:
+            for line in f:
+                row = json.loads(line)
+                chunks.append(row['text'])
+                metadata.append(row['metadata'])
+        embeddings = np.load(base_path + ".npy")
+        yield chunks, metadata, embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG 코퍼스 벌크 로더")
+    parser.add_argument("--source", required=True,
+                        help="JSONL/Parquet 파일, save_to_disk 디렉터리 또는 Hub 데이터셋 이름")
+    parser.add_argument("--output", default="./corpus_index", help="샤드/체크포인트 출력 디렉터리")
+    parser.add_argument("--batch-size", type=int, default=1024, help="샤드당 레코드 수")
+    parser.add_argument("--encode-batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=1, help="임베딩 워커 프로세스 수")
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+    
+    from sentence_transformers import SentenceTransformer
+    embedder = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    
+    loader = BulkCorpusLoader(
+        embedder,
+        args.output,
+        batch_size=args.batch_size,
+        encode_batch_size=args.encode_batch_size,
+        num_workers=args.workers,
+        device=args.device
+    )
+    loader.load(args.source)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,303 @@
+"""
+오프라인 모델 평가 러너
+- model_tuning.ipynb가 저장한 sft_test / dpo_test 분할을 OpenAI 호환 API(vLLM tuned-model 등)로 동시 평가
+- (모델, 프롬프트, 생성 파라미터) 키의 디스크 캐시로 재실행시 새 요청만 전송
+- 지표는 전체 응답을 한 번에 벡터화하여 계산
+"""
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+import numpy as np
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from typing import List, Dict, Optional
+from api_client import VLLMAPIClient
+
+EVAL_SPLITS = ("sft_test", "dpo_test")
+
+# 재현성을 위해 그리디 디코딩 + 고정 시드 기본값
+DEFAULT_PARAMS = {
+    'temperature': 0.0,
+    'top_p': 1.0,
+    'max_tokens': 400,
+    'repetition_penalty': 1.1,
+    'seed': 42
+}
+
+
+class CompletionCache:
+    """(모델, 프롬프트, 파라미터) 키 기반 디스크 캐시 (append-only JSONL)"""
+    
+    def __init__(self, cache_path: str):
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self.entries: Dict[str, Dict] = {}
+        
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 중단으로 잘린 마지막 줄
+                    self.entries[entry['key']] = entry
+    
+    @staticmethod
+    def make_key(model: str, prompt: str, params: Dict) -> str:
+        raw = json.dumps({'model': model, 'prompt': prompt, 'params': params},
+                         sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[Dict]:
+        return self.entries.get(key)
+    
+    def put(self, key: str, entry: Dict):
+        entry = {'key': key, **entry}
+        with self._lock:
+            self.entries[key] = entry
+            with open(self.cache_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class EvaluationRunner:
+    """테스트 분할 프롬프트를 동시에 전송하고 캐시와 지표를 관리하는 러너"""
+    
+    def __init__(
+        self,
+        api_client: VLLMAPIClient,
+        cache: CompletionCache,
+        model: str = "tuned-model",
+        params: Optional[Dict] = None,
+        concurrency: int = 32,   # start_vllm_server.sh의 --max-num-seqs
+        timeout: int = 120
+    ):
+        self.api_client = api_client
+        self.cache = cache
+        self.model = model
+        self.params = dict(DEFAULT_PARAMS, **(params or {}))
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._local = threading.local()
+    
+    def _session(self) -> requests.Session:
+        """스레드별 HTTP 세션 (커넥션 재사용)"""
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+            self._local.session.headers.update(self.api_client.headers)
+        return self._local.session
+    
+    def _complete(self, prompt: str) -> Dict:
+        """단일 프롬프트 생성 (실패시 error 필드 기록)"""
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            **self.params
+        }
+        start_time = time.time()
+        try:
+            response = self._session().post(
+                f"{self.api_client.base_url}/v1/chat/completions",
+                json=payload,
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            result = response.json()
+            return {
+                'response': result["choices"][0]["message"]["content"],
+                'completion_tokens': result.get("usage", {}).get("completion_tokens"),
+                'latency': time.time() - start_time,
+                'error': None
+            }
+        except Exception as e:
+            return {'response': "", 'completion_tokens': None,
+                    'latency': time.time() - start_time, 'error': str(e)}
+    
+    def run(self, records: List[Dict]) -> List[Dict]:
+        """캐시에 없는 프롬프트만 동시 전송 후 입력 순서대로 결과 반환"""
+        keys = [self.cache.make_key(self.model, r['instruction'], self.params) for r in records]
+        outputs: Dict[str, Dict] = {}
+        pending: Dict[str, str] = {}
+        cache_hits, duplicates = 0, 0
+        
+        for key, record in zip(keys, records):
+            if key in outputs or key in pending:
+                duplicates += 1  # 같은 프롬프트는 한 번만 조회/요청
+                continue
+            cached = self.cache.get(key)
+            if cached is not None and not cached['error']:
+                outputs[key] = cached
+                cache_hits += 1
+            else:
+                pending[key] = record['instruction']
+        
+        print(f"💾 캐시 적중: {cache_hits}개 / 새 요청: {len(pending)}개 / 중복 프롬프트: {duplicates}개")
+        
+        if pending:
+            start_time = time.time()
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                futures = {executor.submit(self._complete, prompt): key for key, prompt in pending.items()}
+                for done, future in enumerate(as_completed(futures), 1):
+                    key = futures[future]
+                    entry = {'model': self.model, 'prompt': pending[key], 'params': self.params, **future.result()}
+                    self.cache.put(key, entry)
+                    outputs[key] = entry
+                    if done % 50 == 0 or done == len(futures):
+                        elapsed = time.time() - start_time
+                        print(f"📡 {done}/{len(futures)}개 완료 ({done / elapsed:.1f} req/s)")
+        
+        return [
+            {**record, 'prediction': outputs[key]['response'], 'latency': outputs[key]['latency'],
+             'completion_tokens': outputs[key]['completion_tokens'], 'error': outputs[key]['error']}
+            for key, record in zip(keys, records)
+        ]
+
+
+def compute_metrics(results: List[Dict]) -> Dict:
+    """전체 응답에 대한 지표를 행렬 연산으로 일괄 계산
+    
+    - token_f1: 예측/정답 단어 bag의 겹침 기반 F1 (SQuAD 방식)
+    - tfidf_similarity: 예측/정답 TF-IDF 벡터 코사인 유사도
+      (어휘/IDF는 split별 정답만으로 학습하므로, 같은 응답이면 함께 평가한 split이나
+      다른 응답과 무관하게 같은 점수)
+    """
+    predictions = [r['prediction'] for r in results]
+    references = [r['response'] for r in results]
+    success = np.array([r['error'] is None for r in results])
+    
+    # 단어 bag 겹침 (희소 행렬 원소별 최소값)
+    counter = CountVectorizer(lowercase=True, token_pattern=r"(?u)\b\w+\b")
+    counter.fit(predictions + references)
+    pred_counts = counter.transform(predictions)
+    ref_counts = counter.transform(references)
+    overlap = np.asarray(pred_counts.minimum(ref_counts).sum(axis=1)).ravel()
+    pred_totals = np.asarray(pred_counts.sum(axis=1)).ravel()
+    ref_totals = np.asarray(ref_counts.sum(axis=1)).ravel()
+    precision = np.divide(overlap, pred_totals, out=np.zeros(len(results)), where=pred_totals > 0)
+    recall = np.divide(overlap, ref_totals, out=np.zeros(len(results)), where=ref_totals > 0)
+    token_f1 = np.divide(2 * precision * recall, precision + recall,
+                         out=np.zeros(len(results)), where=(precision + recall) > 0)
+    
+    # TF-IDF 코사인 유사도 (L2 정규화된 행의 원소별 곱 합), split별 고정 기준(정답)으로 IDF 학습
+    tfidf_similarity = np.zeros(len(results))
+    splits = np.array([r.get('split', '') for r in results])
+    for split in np.unique(splits):
+        rows = np.flatnonzero(splits == split)
+        tfidf = TfidfVectorizer(lowercase=True)
+        tfidf.fit([references[i] for i in rows])
+        tfidf_similarity[rows] = np.asarray(
+            tfidf.transform([predictions[i] for i in rows])
+            .multiply(tfidf.transform([references[i] for i in rows])).sum(axis=1)
+        ).ravel()
+    
+    response_length = np.array([len(p) for p in predictions])
+    latency = np.array([r['latency'] for r in results])
+    
+    for i, result in enumerate(results):
+        result['token_f1'] = float(token_f1[i])
+        result['tfidf_similarity'] = float(tfidf_similarity[i])
+    
+    def summarize(mask: np.ndarray) -> Dict:
+        valid = mask & success
+        return {
+            'count': int(mask.sum()),
+            'success_rate': float(valid.sum() / mask.sum()) if mask.sum() else 0.0,
+            'token_f1': float(token_f1[valid].mean()) if valid.any() else 0.0,
+            'tfidf_similarity': float(tfidf_similarity[valid].mean()) if valid.any() else 0.0,
+            'avg_response_length': float(response_length[valid].mean()) if valid.any() else 0.0,
+            'p50_latency': float(np.percentile(latency[valid], 50)) if valid.any() else 0.0
+        }
+    
+    metrics = {'overall': summarize(np.ones(len(results), dtype=bool))}
+    for group_key in ('split', 'source'):
+        labels = np.array([r.get(group_key, '') for r in results])
+        metrics[f'by_{group_key}'] = {
+            str(label): summarize(labels == label) for label in np.unique(labels)
+        }
+    return metrics
+
+
+def load_split(data_dir: str, split: str) -> List[Dict]:
+    """노트북에서 저장한 분할(JSONL) 로드"""
+    path = os.path.join(data_dir, f"{split}.jsonl")
+    if not os.path.exists(path):
+        raise ValueError(f"평가 데이터가 없습니다: {path} (model_tuning.ipynb의 데이터 분할 셀을 먼저 실행하세요)")
+    
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                record['split'] = split
+                records.append(record)
+    return records
+
+
+def print_metrics(metrics: Dict):
+    """평가 지표 출력"""
+    overall = metrics['overall']
+    print("\n📊 평가 결과:")
+    print(f"   ✅ 성공률: {overall['success_rate'] * 100:.1f}% ({overall['count']}개)")
+    print(f"   🎯 Token F1: {overall['token_f1']:.4f}")
+    print(f"   🔍 TF-IDF 유사도: {overall['tfidf_similarity']:.4f}")
+    print(f"   📏 평균 응답 길이: {overall['avg_response_length']:.1f} 문자")
+    print(f"   ⏱️  지연시간 p50: {overall['p50_latency']:.2f}초")
+    
+    for group_key in ('by_split', 'by_source'):
+        print(f"\n📂 {group_key[3:]}별:")
+        for label, summary in metrics[group_key].items():
+            print(f"   {label}: {summary['count']}개, F1 {summary['token_f1']:.4f}, "
+                  f"TF-IDF {summary['tfidf_similarity']:.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="테스트 분할 오프라인 평가 (OpenAI 호환 API)")
+    parser.add_argument("--data-dir", default="./eval_data", help="sft_test.jsonl / dpo_test.jsonl 위치")
+    parser.add_argument("--splits", nargs="+", default=list(EVAL_SPLITS))
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--model", default="tuned-model")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--temperature", type=float, default=DEFAULT_PARAMS['temperature'])
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_PARAMS['max_tokens'])
+    parser.add_argument("--seed", type=int, default=DEFAULT_PARAMS['seed'])
+    parser.add_argument("--cache", default="./eval_data/completions_cache.jsonl")
+    parser.add_argument("--output", default="./eval_data/eval_results.json")
+    args = parser.parse_args()
+    
+    records = []
+    for split in args.splits:
+        records.extend(load_split(args.data_dir, split))
+    print(f"🧪 평가 데이터: {len(records)}개 ({', '.join(args.splits)})")
+    
+    api_client = VLLMAPIClient(args.base_url)
+    if not api_client.health_check():
+        raise ValueError(f"API 서버에 연결할 수 없습니다: {args.base_url}")
+    
+    os.makedirs(os.path.dirname(os.path.abspath(args.cache)), exist_ok=True)
+    runner = EvaluationRunner(
+        api_client,
+        CompletionCache(args.cache),
+        model=args.model,
+        params={'temperature': args.temperature, 'max_tokens': args.max_tokens, 'seed': args.seed},
+        concurrency=args.concurrency
+    )
+    
+    start_time = time.time()
+    results = runner.run(records)
+    metrics = compute_metrics(results)
+    print_metrics(metrics)
+    print(f"\n⏱️  총 소요 시간: {time.time() - start_time:.1f}초")
+    
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'model': args.model, 'params': runner.params, 'metrics': metrics, 'results': results},
+                  f, ensure_ascii=False, indent=2)
+    print(f"💾 결과 저장: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,108 @@
+"""
+MinHash/LSH 기반 근사 중복 청크 탐지
+"""
+
+import zlib
+import numpy as np
+from typing import List, Dict, Tuple
+
+
+class NearDuplicateIndex:
+    """MinHash 시그니처 + LSH 밴딩으로 기존 청크에 (거의) 포함되는 청크 탐지
+    
+    - 문자 n-gram 셰이글 사용 (영어/한국어 모두 동작)
+    - bands=16, rows=8 기준 후보 Jaccard 임계값 약 0.71
+    - 후보는 Jaccard가 아닌 포함도(새 청크 셰이글 중 기존 청크에 있는 비율) 추정치로 거름
+      (오버랩 윈도우 청크처럼 Jaccard는 높아도 새 문장이 있는 청크를 병합하지 않기 위함)
+    - 추정치만으로는 병합하지 않음: 호출 측에서 문장 단위 포함 여부를 확인한 뒤 병합
+    """
+    
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        num_perm: int = 128,
+        bands: int = 16,
+        shingle_size: int = 5,
+        seed: int = 42
+    ):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm은 bands로 나누어 떨어져야 합니다.")
+        
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        
+        # multiply-add-shift 해시 파라미터 (64비트 a, b / uint64 오버플로우를 mod 2^64로 사용)
+        rng = np.random.RandomState(seed)
+        self._a = self._random_uint64(rng, num_perm) | np.uint64(1)
+        self._b = self._random_uint64(rng, num_perm)
+        
+        self.buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        self.signatures: Dict[int, np.ndarray] = {}
+        self.sizes: Dict[int, int] = {}  # 항목별 셰이글 수 (포함도 추정용)
+    
+    @staticmethod
+    def _random_uint64(rng: np.random.RandomState, size: int) -> np.ndarray:
+        high = rng.randint(0, 2**32, size=size, dtype=np.uint64)
+        low = rng.randint(0, 2**32, size=size, dtype=np.uint64)
+        return (high << np.uint64(32)) | low
+    
+    def _shingles(self, text: str) -> np.ndarray:
+        """정규화된 텍스트의 문자 n-gram 해시"""
+        text = " ".join(text.lower().split())
+        k = self.shingle_size
+        if len(text) <= k:
+            grams = {text}
+        else:
+            grams = {text[i:i + k] for i in range(len(text) - k + 1)}
+        return np.fromiter(
+            (zlib.crc32(gram.encode("utf-8")) for gram in grams),
+            dtype=np.uint64,
+            count=len(grams)
+        )
+    
+    def sketch(self, text: str) -> Tuple[np.ndarray, int]:
+        """MinHash 시그니처와 셰이글 수 계산"""
+        shingles = self._shingles(text)
+        hashed = (np.outer(self._a, shingles) + self._b[:, None]) >> np.uint64(32)
+        return hashed.min(axis=1), len(shingles)
+    
+    def containment(self, text: str, other_text: str) -> float:
+        """text의 셰이글 중 other_text에도 있는 비율 (정확한 값)"""
+        shingles = set(self._shingles(text).tolist())
+        other_shingles = set(self._shingles(other_text).tolist())
+        return len(shingles & other_shingles) / len(shingles) if shingles else 1.0
+    
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [
+            signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+    
+    def candidates(self, signature: np.ndarray, size: int) -> List[Tuple[int, float]]:
+        """새 항목을 임계값 이상 포함하는 기존 항목과 추정 포함도 (포함도, Jaccard 내림차순)
+        
+        포함도 = |A∩B| / |A| = J(|A| + |B|) / ((1 + J)|A|)  (J: MinHash 추정 Jaccard)
+        """
+        candidate_ids = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            candidate_ids.update(self.buckets[band].get(key, ()))
+        
+        matches = []
+        for candidate in candidate_ids:
+            jaccard = float(np.mean(self.signatures[candidate] == signature))
+            containment = min(1.0, jaccard * (size + self.sizes[candidate]) / ((1 + jaccard) * size))
+            if containment >= self.threshold:
+                matches.append((containment, jaccard, candidate))
+        
+        matches.sort(reverse=True)
+        return [(candidate, containment) for containment, _, candidate in matches]
+    
+    def add(self, item_id: int, signature: np.ndarray, size: int):
+        """시그니처를 LSH 버킷에 등록"""
+        self.signatures[item_id] = signature
+        self.sizes[item_id] = size
+        for band, key in enumerate(self._band_keys(signature)):
+            self.buckets[band].setdefault(key, []).append(item_id)
\ No newline at end of file
@@ -5,31 +5,107 @@
 import streamlit as st
 from sentence_transformers import SentenceTransformer
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import faiss
 import numpy as np
-from datasets import load_dataset
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional, Iterator, Union
 from api_client import VLLMAPIClient
+from context_packer import ContextPacker
+from single_flight import SingleFlightClient
+from near_dedup import NearDuplicateIndex
+from sharded_index import ShardedIndex
+from corpus_loader import EMBEDDING_MODEL_NAME, chunk_knowledge_item, iter_shards, read_checkpoint
 import PyPDF2
 import pdfplumber
 import io
 import os
+import time
 from datetime import datetime
 
+SOURCE_KEYS = ('source_type', 'filename', 'chunk_index', 'upload_time', 'source_index')  # 청크 출처 메타데이터 필드
+
+def build_partitions(chunk_metadata: List[Dict], offset: int = 0) -> Dict[Tuple[str, str], np.ndarray]:
+    """메타데이터 기반 파티션 구축 (source_type / filename 별 전역 청크 ID, offset부터 시작)"""
+    partitions = {}
+    for idx, metadata in enumerate(chunk_metadata, offset):
+        # 근사 중복으로 병합된 청크는 공유하는 모든 문서의 파티션에 포함
+        for ref in [metadata] + metadata.get('shared_with', []):
+            source_type = ref.get('source_type', 'basic')
+            partitions.setdefault(('source_type', source_type), set()).add(idx)
+            if 'filename' in ref:
+                partitions.setdefault(('filename', ref['filename']), set()).add(idx)
+    
+    return {
+        key: np.array(sorted(ids), dtype='int64') for key, ids in partitions.items()
+    }
+
+class BulkCorpus:
+    """corpus_loader.py가 만든 벌크 코퍼스와 검색 인덱스 (세션 간 읽기 전용 공유)
+    
+    청크 ID [0, len(chunks))를 차지하며, 세션별 청크(PDF 등)는 그 뒤에 별도 샤드로 인덱싱됩니다.
+    임베딩은 FAISS 인덱스에 복사한 뒤 따로 보관하지 않습니다.
+    """
+    
+    def __init__(self, corpus_dir: str):
+        checkpoint = read_checkpoint(corpus_dir)
+        if not checkpoint['completed']:
+            raise ValueError(f"코퍼스 로드가 완료되지 않았습니다. corpus_loader.py를 다시 실행하세요: {corpus_dir}")
+        if checkpoint['embedding_model'] != EMBEDDING_MODEL_NAME:
+            raise ValueError(f"임베딩 모델이 다릅니다: {checkpoint['embedding_model']}")
+        if checkpoint['total_chunks'] == 0:
+            raise ValueError("코퍼스에 청크가 없습니다.")
+        
+        # 전체 크기를 미리 할당하여 샤드별로 채움 (중간 복사 없음)
+        embeddings = np.empty((checkpoint['total_chunks'], checkpoint['embedding_dim']), dtype='float32')
+        self.chunks, self.chunk_metadata = [], []
+        
+        for chunks, metadata, shard_embeddings in iter_shards(corpus_dir):
+            position = len(self.chunks)
+            embeddings[position:position + len(chunks)] = shard_embeddings
+            self.chunks.extend(chunks)
+            self.chunk_metadata.extend(metadata)
+        
+        print(f"🔍 벌크 벡터 인덱스 구축 중... ({len(self.chunks):,}개 청크)")
+        self.search_index = ShardedIndex()
+        self.search_index.build_vectors(embeddings)
+        del embeddings
+        
+        # 어휘/IDF는 벌크 코퍼스 기준으로 한 번만 학습 (세션 청크는 세션 샤드에서 따로 학습)
+        print("📈 벌크 TF-IDF 인덱스 구축 중...")
+        self.tfidf_vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
+        self.search_index.build_keywords(self.tfidf_vectorizer.fit_transform(self.chunks), self.tfidf_vectorizer)
+        
+        self.partitions = build_partitions(self.chunk_metadata)
+        # 코퍼스 로드시 측정한 청크당 임베딩 시간 (이전 체크포인트에는 없음)
+        self.embedding_seconds_per_chunk = checkpoint.get('embedding_seconds', 0.0) / checkpoint['total_chunks']
+        print(
+            f"✅ 벌크 코퍼스 로드 완료: {len(self.chunks):,}개 청크 "
+            f"(파일 샤드 {checkpoint['shards']}개, 검색 샤드 {len(self.search_index.shards)}개)"
+        )
+
 class SimpleRAGSystem:
     """간소화된 RAG 시스템"""
     
     def __init__(self, api_client: VLLMAPIClient):
         self.api_client = api_client
-        self.chunks = []
+        self.llm_client = SingleFlightClient(api_client)  # 동일 요청 병합 레이어
+        self.chunks = []          # 세션 청크 (샘플 데이터 / PDF), 전역 ID는 bulk_chunk_count부터
         self.chunk_metadata = []
-        self.vector_index = None
+        self.search_index = ShardedIndex()  # 샤드별 벡터/키워드 인덱스
         self.embedder = None
+        self.chunk_embeddings = None  # 세션 청크 임베딩 캐시 (재구축시 새 청크만 임베딩)
+        self.bulk = None              # 공유 벌크 코퍼스 (BulkCorpus, 읽기 전용)
+        self.bulk_chunk_count = 0     # 벌크 코퍼스 청크 수
         self.tfidf_vectorizer = None
         self.tfidf_matrix = None
+        self.partitions = {}     # (필드, 값) -> 청크 ID 배열
+        self.context_packer = None
         self.initialized = False
         
+        # 근사 중복 청크 관련 상태
+        self.dedup_index = NearDuplicateIndex()
+        self.embedding_seconds_per_chunk = 0.0  # 최근 측정한 청크당 임베딩 시간
+        self.embedding_seconds_saved = 0.0      # 병합으로 수집시 임베딩하지 않은 시간 (누적, 1회성)
+        self.pending_collapsed_chunks = 0       # 임베딩 시간 측정 전이라 절감 시간에 아직 반영 안 된 병합 수
+        
         # PDF 관련 상태
         self.pdf_documents = []  # 업로드된 PDF 문서들
         self.pdf_chunks = []     # PDF에서 추출한 청크들
@@ -38,13 +114,105 @@ class SimpleRAGSystem:
     @st.cache_resource
     def load_embedding_model(_self):
         """임베딩 모델 로드 (캐시)"""
-        return SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+        return SentenceTransformer(EMBEDDING_MODEL_NAME)
+    
+    @st.cache_resource
+    def load_bulk_corpus(_self, corpus_dir: str) -> BulkCorpus:
+        """벌크 코퍼스 + 검색 인덱스 로드 (캐시, 모든 세션이 같은 객체를 공유)"""
+        return BulkCorpus(corpus_dir)
     
-    def initialize(self):
-        """시스템 초기화"""
+    @st.cache_resource
+    def load_tokenizer(_self):
+        """서빙 모델 토크나이저 로드 (캐시, 실패시 None)"""
+        try:
+            from transformers import AutoTokenizer
+            return AutoTokenizer.from_pretrained(
+                "meta-llama/Llama-2-7b-chat-hf",
+                token=os.environ.get("HF_TOKEN")
+            )
+        except Exception as e:
+            print(f"⚠️ 로컬 토크나이저 로드 실패, 서버 /tokenize 사용: {e}")
+            return None
+    
+    def _build_context_packer(self):
+        """토큰 예산 기반 컨텍스트 패커 생성"""
+        tokenizer = self.load_tokenizer()
+        if tokenizer is not None:
+            count_tokens = lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+            self.context_packer = ContextPacker(count_tokens, max_workers=1)
+        else:
+            # 서버 /tokenize 호출은 후보 청크별로 동시에 전송
+            self.context_packer = ContextPacker(self.api_client.count_tokens)
+    
+    def initialize(self, corpus_dir: Optional[str] = None):
+        """시스템 초기화
+        
+        corpus_dir(또는 RAG_CORPUS_DIR 환경 변수)가 주어지면 corpus_loader.py로
+        미리 청킹/임베딩해 둔 벌크 코퍼스를 사용하고, 없으면 샘플 데이터를 사용합니다.
+        """
         if self.initialized:
             return
         
+        corpus_dir = corpus_dir or os.environ.get("RAG_CORPUS_DIR")
+        
+        # 임베딩 모델 로드
+        print("📦 임베딩 모델 로딩 중...")
+        self.embedder = self.load_embedding_model()
+        self.chunk_embeddings = None
+        self.dedup_index = NearDuplicateIndex()
+        
+        if corpus_dir:
+            # 벌크 코퍼스 로드 (프로세스당 한 번, 세션 간 공유)
+            print(f"📦 벌크 코퍼스 로딩 중: {corpus_dir}")
+            self.bulk = self.load_bulk_corpus(os.path.abspath(corpus_dir))
+            self.bulk_chunk_count = len(self.bulk.chunks)
+            self.embedding_seconds_per_chunk = self.bulk.embedding_seconds_per_chunk
+            self.search_index = ShardedIndex(base=self.bulk.search_index)
+            self.chunks, self.chunk_metadata = [], []
+        else:
+            knowledge_data = self._load_sample_knowledge()
+            
+            # Context 청킹
+            print("📝 텍스트 청킹 중...")
+            self._chunk_contexts(knowledge_data)
+            
+            # 근사 중복 청크 병합
+            print("🧬 근사 중복 청크 탐지 중...")
+            base_chunks = [
+                {'text': chunk, 'metadata': metadata}
+                for chunk, metadata in zip(self.chunks, self.chunk_metadata)
+            ]
+            self.chunks, self.chunk_metadata = [], []
+            unique_chunks = self._collapse_near_duplicates(base_chunks)
+            self.chunks = [chunk['text'] for chunk in unique_chunks]
+            self.chunk_metadata = [chunk['metadata'] for chunk in unique_chunks]
+        
+        # 데이터 확인
+        if not self.chunks and self.bulk is None:
+            raise ValueError("청킹 후에도 데이터가 없습니다.")
+            
+        print(f"📊 생성된 청크 수: {self.bulk_chunk_count + len(self.chunks)}")
+        
+        # 벡터 인덱스 구축
+        print("🔍 벡터 인덱스 구축 중...")
+        self._build_vector_index()
+        
+        # TF-IDF 인덱스 구축
+        print("📈 TF-IDF 인덱스 구축 중...")
+        self._build_tfidf_index()
+        
+        # 메타데이터 파티션 구축
+        self._build_partitions()
+        
+        # 컨텍스트 패커 준비
+        print("🔤 토크나이저 로딩 중...")
+        self._build_context_packer()
+        
+        print("✅ RAG 시스템 초기화 완료!")
+        self.initialized = True
+    
+    def _load_sample_knowledge(self) -> List[Dict]:
+        """샘플 지식 데이터 (벌크 코퍼스가 없을 때 사용)"""
         try:
             # 대안 데이터셋 사용 (더 적은 데이터로 테스트)
             print("📦 대안 데이터셋 사용...")
@@ -90,120 +258,231 @@ class SimpleRAGSystem:
         if not knowledge_data:
             raise ValueError("지식 데이터가 없습니다.")
         
-        # 임베딩 모델 로드
-        print("📦 임베딩 모델 로딩 중...")
-        self.embedder = self.load_embedding_model()
-        
-        # Context 청킹
-        print("📝 텍스트 청킹 중...")
-        self._chunk_contexts(knowledge_data)
-        
-        # 데이터 확인
-        if not self.chunks:
-            raise ValueError("청킹 후에도 데이터가 없습니다.")
-            
-        print(f"📊 생성된 청크 수: {len(self.chunks)}")
-        
-        # 벡터 인덱스 구축
-        print("🔍 벡터 인덱스 구축 중...")
-        self._build_vector_index()
-        
-        # TF-IDF 인덱스 구축
-        print("📈 TF-IDF 인덱스 구축 중...")
-        self._build_tfidf_index()
-        
-        print("✅ RAG 시스템 초기화 완료!")
-        self.initialized = True
+        return knowledge_data
     
     def _chunk_contexts(self, knowledge_data: List[Dict]):
         """Context를 청크로 분할"""
-        chunk_size = 300
         self.chunks = []
         self.chunk_metadata = []
         
         for item in knowledge_data:
-            context = item['context']
-            # 간단한 청킹 (문장 단위)
-            sentences = context.split('. ')
+            for chunk, metadata in chunk_knowledge_item(item, chunk_size=300):
+                self.chunks.append(chunk)
+                self.chunk_metadata.append(metadata)
+    
+    def _source_ref(self, metadata: Dict) -> Dict:
+        """청크 출처 정보 (근사 중복 병합 기록용, 대표 출처 교체시 그대로 메타데이터가 됨)"""
+        if metadata.get('source_type') == 'pdf':
+            return {
+                'source_type': 'pdf',
+                'filename': metadata['filename'],
+                'chunk_index': metadata['chunk_index'],
+                'upload_time': metadata.get('upload_time')
+            }
+        return {'source_type': 'basic', 'source_index': metadata.get('source_index')}
+    
+    @staticmethod
+    def _split_sentences(text: str) -> List[str]:
+        """청킹과 같은 기준('. ')으로 문장 분리 (공백/마침표 정규화)"""
+        sentences = []
+        for sentence in text.split('. '):
+            sentence = ' '.join(sentence.split()).rstrip('.')
+            if sentence:
+                sentences.append(sentence)
+        return sentences
+    
+    def _sentence_covered(self, sentence: str, texts: List[str]) -> bool:
+        """문장이 주어진 청크 중 하나에 (근사적으로) 포함되는지 확인"""
+        return any(
+            sentence in ' '.join(text.split())
+            or self.dedup_index.containment(sentence, text) >= self.dedup_index.threshold
+            for text in texts
+        )
+    
+    def _collapse_near_duplicates(self, new_chunks: List[Dict]) -> List[Dict]:
+        """기존(또는 먼저 나온) 청크에 모든 문장이 포함되는 청크를 병합하고 고유 청크만 반환
+        
+        MinHash 포함도 추정으로 후보를 찾고, 문장 단위로 확인하여 새 문장이 하나라도 있으면
+        (오버랩 윈도우 청크 등) 병합하지 않습니다. 병합된 청크의 출처는 대표 청크 메타데이터의
+        'shared_with'에 기록됩니다.
+        """
+        unique_chunks = []
+        base_id = len(self.chunks)
+        
+        for chunk in new_chunks:
+            chunk_id = base_id + len(unique_chunks)
+            signature, size = self.dedup_index.sketch(chunk['text'])
+            sentences = self._split_sentences(chunk['text'])
             
-            current_chunk = ""
-            for sentence in sentences:
-                if len(current_chunk + sentence) < chunk_size:
-                    current_chunk += sentence + ". "
+            # 포함도 추정이 높은 후보부터 모든 문장이 실제로 포함되는지 확인
+            target = None
+            for match_id, _ in self.dedup_index.candidates(signature, size):
+                if match_id < base_id:
+                    candidate = {'text': self.chunks[match_id], 'metadata': self.chunk_metadata[match_id]}
                 else:
-                    if current_chunk:
-                        self.chunks.append(current_chunk.strip())
-                        self.chunk_metadata.append({
-                            'source_index': item['index'],
-                            'user_message': item['user_message'],
-                            'response': item['response']
-                        })
-                    current_chunk = sentence + ". "
+                    candidate = unique_chunks[match_id - base_id]
+                if all(self._sentence_covered(sentence, [candidate['text']]) for sentence in sentences):
+                    target = candidate
+                    break
             
-            # 마지막 청크 추가
-            if current_chunk:
-                self.chunks.append(current_chunk.strip())
-                self.chunk_metadata.append({
-                    'source_index': item['index'],
-                    'user_message': item['user_message'],
-                    'response': item['response']
-                })
+            if target is None:
+                self.dedup_index.add(chunk_id, signature, size)
+                unique_chunks.append(chunk)
+                continue
+            
+            target['metadata'].setdefault('shared_with', []).append(self._source_ref(chunk['metadata']))
+        
+        collapsed = len(new_chunks) - len(unique_chunks)
+        self.pending_collapsed_chunks += collapsed
+        self._account_embedding_savings()
+        if collapsed:
+            print(f"🧬 근사 중복 청크 {collapsed}개 병합 ({len(new_chunks)}개 → {len(unique_chunks)}개)")
+        
+        return unique_chunks
     
-    def _build_vector_index(self):
-        """벡터 인덱스 구축"""
-        embeddings = self.embedder.encode(self.chunks)
+    def _uncovered_sentences(self, text: str, filename: str) -> List[str]:
+        """문서 문장 중 문서가 속한(대표 또는 shared_with) 어떤 청크에도 없는 문장 (병합 검증용)"""
+        doc_texts = [
+            chunk for chunk, metadata in zip(self.chunks, self.chunk_metadata)
+            if any(ref.get('filename') == filename for ref in [metadata] + metadata.get('shared_with', []))
+        ]
+        indexed_sentences = {sentence for chunk in doc_texts for sentence in self._split_sentences(chunk)}
+        
+        return [
+            sentence for sentence in self._split_sentences(text)
+            if sentence not in indexed_sentences and not self._sentence_covered(sentence, doc_texts)
+        ]
+    
+    def _rebuild_dedup_index(self):
+        """현재 청크 기준으로 근사 중복 인덱스 재구축"""
+        # 세션 청크만 등록 (벌크 청크는 시그니처 메모리가 코퍼스 크기에 비례하므로 제외)
+        self.dedup_index = NearDuplicateIndex()
+        for chunk_id in range(len(self.chunks)):
+            self.dedup_index.add(chunk_id, *self.dedup_index.sketch(self.chunks[chunk_id]))
+    
+    def _account_embedding_savings(self):
+        """병합된 청크 수를 청크당 임베딩 시간으로 환산해 누적 (측정 전이면 보류)"""
+        if self.embedding_seconds_per_chunk > 0:
+            self.embedding_seconds_saved += self.pending_collapsed_chunks * self.embedding_seconds_per_chunk
+            self.pending_collapsed_chunks = 0
+    
+    def _encode_chunks(self) -> np.ndarray:
+        """아직 임베딩되지 않은 청크만 임베딩하여 캐시에 추가 (청크당 임베딩 시간 기록)"""
+        done = 0 if self.chunk_embeddings is None else len(self.chunk_embeddings)
+        new_chunks = self.chunks[done:]
+        
+        if new_chunks:
+            start_time = time.time()
+            new_embeddings = self.embedder.encode(new_chunks).astype('float32')
+            self.embedding_seconds_per_chunk = (time.time() - start_time) / len(new_chunks)
+            self._account_embedding_savings()
+            if self.chunk_embeddings is None:
+                self.chunk_embeddings = new_embeddings
+            else:
+                self.chunk_embeddings = np.vstack([self.chunk_embeddings, new_embeddings])
         
-        # FAISS 인덱스 구축
-        dimension = embeddings.shape[1]
-        self.vector_index = faiss.IndexFlatL2(dimension)
-        self.vector_index.add(embeddings.astype('float32'))
+        return self.chunk_embeddings
+    
+    def _build_vector_index(self):
+        """세션 청크 벡터 인덱스 구축 (벌크 샤드는 그대로 두고 함께 검색)"""
+        embeddings = self._encode_chunks()
+        if embeddings is None:
+            embeddings = np.empty((0, 0), dtype='float32')
+        
+        # 샤드별 FAISS 인덱스 구축
+        self.search_index.build_vectors(embeddings, start=self.bulk_chunk_count)
+        total_shards = len(self.search_index.base_shards) + len(self.search_index.shards)
+        if total_shards > 1:
+            print(f"🧩 {total_shards}개 샤드로 분할")
     
     def _build_tfidf_index(self):
-        """TF-IDF 인덱스 구축"""
-        self.tfidf_vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
-        self.tfidf_matrix = self.tfidf_vectorizer.fit_transform(self.chunks)
+        """세션 청크 TF-IDF 인덱스 구축
+        
+        어휘/IDF는 세션 청크 기준으로 학습하고 행렬만 샤드별로 분할합니다. 벌크 모드에서도
+        벌크 어휘를 빌려 쓰지 않으므로 벌크 코퍼스에 없는 PDF 용어(예: 한국어)도 검색되며,
+        벌크 샤드는 자체 벡터라이저를 유지해 다시 학습/구축하지 않습니다.
+        """
+        if self.chunks:
+            self.tfidf_vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
+            self.tfidf_matrix = self.tfidf_vectorizer.fit_transform(self.chunks)
+        else:
+            self.tfidf_vectorizer = None
+            self.tfidf_matrix = None
+        self.search_index.build_keywords(self.tfidf_matrix, self.tfidf_vectorizer)
+    
+    def _build_partitions(self):
+        """세션 청크 파티션 구축 (벌크 파티션은 BulkCorpus에 한 번만 구축)"""
+        self.partitions = build_partitions(self.chunk_metadata, offset=self.bulk_chunk_count)
+    
+    def _get_chunk(self, idx: int) -> Tuple[str, Dict]:
+        """전역 청크 ID로 (청크, 메타데이터) 조회"""
+        if idx < self.bulk_chunk_count:
+            return self.bulk.chunks[idx], self.bulk.chunk_metadata[idx]
+        local_idx = idx - self.bulk_chunk_count
+        return self.chunks[local_idx], self.chunk_metadata[local_idx]
+    
+    def _resolve_filters(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        """필터 조건에 해당하는 청크 ID 배열 반환 (필터가 없으면 None)
+        
+        filters 예시: {'source_type': 'pdf'}, {'filename': ['a.pdf', 'b.pdf']}
+        필드 간에는 AND, 같은 필드의 여러 값은 OR로 결합합니다.
+        """
+        if not filters:
+            return None
+        
+        matched_ids = None
+        for field, value in filters.items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            partition_sets = [self.partitions] + ([self.bulk.partitions] if self.bulk is not None else [])
+            field_ids = [partitions.get((field, v)) for partitions in partition_sets for v in values]
+            field_ids = [ids for ids in field_ids if ids is not None]
+            ids = np.unique(np.concatenate(field_ids)) if field_ids else np.array([], dtype='int64')
+            matched_ids = ids if matched_ids is None else np.intersect1d(matched_ids, ids)
+        
+        return matched_ids
     
-    def semantic_search(self, query: str, k: int = 3) -> List[Tuple[str, Dict, float]]:
+    def semantic_search(self, query: str, k: int = 3, filters: Optional[Dict] = None) -> List[Tuple[str, Dict, float]]:
         """의미적 검색"""
-        query_embedding = self.embedder.encode([query])
-        distances, indices = self.vector_index.search(query_embedding.astype('float32'), k)
+        candidate_ids = self._resolve_filters(filters)
+        if candidate_ids is not None and len(candidate_ids) == 0:
+            return []
+        
+        query_embedding = self.embedder.encode([query]).astype('float32')
+        
+        # 샤드별 top-k 후 k-way 병합 (필터가 있으면 각 샤드에서 부분집합 안에서만 검색)
+        hits = self.search_index.vector_search(query_embedding, k, candidate_ids)
         
         results = []
-        for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-            if idx < len(self.chunks):
+        for distance, idx in hits:
+            if 0 <= idx < self.bulk_chunk_count + len(self.chunks):
                 similarity = 1 / (1 + distance)  # 거리를 유사도로 변환
-                results.append((
-                    self.chunks[idx],
-                    self.chunk_metadata[idx],
-                    similarity
-                ))
+                chunk, metadata = self._get_chunk(idx)
+                results.append((chunk, metadata, similarity))
         
         return results
     
-    def keyword_search(self, query: str, k: int = 3) -> List[Tuple[str, Dict, float]]:
+    def keyword_search(self, query: str, k: int = 3, filters: Optional[Dict] = None) -> List[Tuple[str, Dict, float]]:
         """키워드 검색"""
-        query_vector = self.tfidf_vectorizer.transform([query])
-        similarities = cosine_similarity(query_vector, self.tfidf_matrix).flatten()
+        candidate_ids = self._resolve_filters(filters)
+        if candidate_ids is not None and len(candidate_ids) == 0:
+            return []
         
-        # 상위 k개 인덱스
-        top_indices = similarities.argsort()[-k:][::-1]
+        # 샤드별 top-k 후 k-way 병합 (필터가 있으면 해당 파티션의 행만 사용)
+        hits = self.search_index.keyword_search(query, k, candidate_ids)
         
         results = []
-        for idx in top_indices:
-            if similarities[idx] > 0:  # 유사도가 0보다 큰 경우만
-                results.append((
-                    self.chunks[idx],
-                    self.chunk_metadata[idx],
-                    similarities[idx]
-                ))
+        for similarity, idx in hits:
+            if similarity > 0:  # 유사도가 0보다 큰 경우만
+                chunk, metadata = self._get_chunk(idx)
+                results.append((chunk, metadata, similarity))
         
         return results
     
-    def hybrid_search(self, query: str, k: int = 3) -> List[Tuple[str, Dict, float]]:
+    def hybrid_search(self, query: str, k: int = 3, filters: Optional[Dict] = None) -> List[Tuple[str, Dict, float]]:
         """하이브리드 검색"""
         # 의미적 검색과 키워드 검색 결합
-        semantic_results = self.semantic_search(query, k)
-        keyword_results = self.keyword_search(query, k)
+        semantic_results = self.semantic_search(query, k, filters)
+        keyword_results = self.keyword_search(query, k, filters)
         
         # 결과 통합 (간단한 방식)
         all_results = {}
@@ -227,51 +506,44 @@ class SimpleRAGSystem:
         sorted_results = sorted(all_results.values(), key=lambda x: x[2], reverse=True)
         return sorted_results[:k]
     
-    def generate_answer(self, query: str, search_method: str = "hybrid") -> Tuple[str, List[Dict]]:
-        """답변 생성"""
+    def generate_answer(self, query: str, search_method: str = "hybrid",
+                        filters: Optional[Dict] = None, k: int = 8,
+                        stream: bool = False) -> Tuple[Union[str, Iterator[str]], List[Dict]]:
+        """답변 생성 (stream=True면 답변 대신 토큰 이터레이터 반환, 오류 메시지는 문자열)"""
         if not self.initialized:
             return "시스템이 초기화되지 않았습니다.", []
         
-        # 검색 수행
+        # 검색 수행 (토큰 예산만큼 채울 수 있도록 후보를 넉넉히 검색)
         if search_method == "semantic":
-            search_results = self.semantic_search(query)
+            search_results = self.semantic_search(query, k, filters)
         elif search_method == "keyword":
-            search_results = self.keyword_search(query)
+            search_results = self.keyword_search(query, k, filters)
         else:
-            search_results = self.hybrid_search(query)
+            search_results = self.hybrid_search(query, k, filters)
         
         if not search_results:
             return "관련 정보를 찾을 수 없습니다.", []
         
-        # 컨텍스트 구성
-        context_parts = []
-        source_docs = []
+        # 토큰 예산 안에서 컨텍스트 패킹 (max-model-len 2048 - max_tokens 256)
+        prompt, packed_results = self.context_packer.pack(query, search_results)
         
-        for chunk, metadata, score in search_results:
-            context_parts.append(f"- {chunk}")
+        if len(packed_results) < len(search_results):
+            print(f"⚠️ 토큰 예산 초과/중복으로 {len(search_results) - len(packed_results)}개 청크 제외")
+        
+        source_docs = []
+        for chunk, metadata, score in sorted(packed_results, key=lambda x: x[2], reverse=True):
             source_docs.append({
                 'chunk': chunk,
                 'score': score,
                 'metadata': metadata
             })
         
-        context = "\n".join(context_parts)
-        
-        # 컨텍스트 길이 제한 (토큰 오버플로우 방지)
-        max_context_length = 800  # 충분한 여유를 두고 설정
-        if len(context) > max_context_length:
-            context = context[:max_context_length] + "..."
-            print(f"⚠️ 컨텍스트가 너무 길어서 {max_context_length}자로 잘렸습니다.")
-        
-        # 프롬프트 구성 (간소화)
-        prompt = f"""참고 정보: {context}
-
-질문: {query}
-
-답변:"""
-        
-        # API 호출
-        answer = self.api_client.simple_chat(prompt)
+        # API 호출 (동시에 들어온 동일 프롬프트는 업스트림 호출 하나를 공유,
+        # 스트리밍이면 늦게 합류한 요청은 이미 생성된 토큰부터 재생)
+        if stream:
+            answer = self.llm_client.simple_chat_stream(prompt)
+        else:
+            answer = self.llm_client.simple_chat(prompt)
         
         return answer, source_docs
     
@@ -327,12 +599,22 @@ class SimpleRAGSystem:
                 st.error("PDF 텍스트 청킹에 실패했습니다.")
                 return False
             
+            # 근사 중복 청크 병합 (문서 내 오버랩 + 기존 문서와의 중복)
+            unique_chunks = self._collapse_near_duplicates(pdf_chunks)
+            
             pdf_doc['chunk_count'] = len(pdf_chunks)
+            pdf_doc['collapsed_count'] = len(pdf_chunks) - len(unique_chunks)
             self.pdf_documents.append(pdf_doc)
             
             # 기존 청크와 통합
-            self.chunks.extend([chunk['text'] for chunk in pdf_chunks])
-            self.chunk_metadata.extend([chunk['metadata'] for chunk in pdf_chunks])
+            self.chunks.extend([chunk['text'] for chunk in unique_chunks])
+            self.chunk_metadata.extend([chunk['metadata'] for chunk in unique_chunks])
+            
+            # 병합 후에도 문서의 모든 문장이 검색 가능한지 확인
+            uncovered = self._uncovered_sentences(pdf_text, filename)
+            if uncovered:
+                print(f"⚠️ '{filename}' 문장 {len(uncovered)}개가 인덱스된 청크에 없습니다: {uncovered[:3]}")
+                st.warning(f"⚠️ 근사 중복 병합 후 누락된 문장 {len(uncovered)}개가 있습니다.")
             
             # 벡터 인덱스 재구축
             self._rebuild_indices()
@@ -390,32 +672,45 @@ class SimpleRAGSystem:
         return chunks
     
     def _rebuild_indices(self):
-        """벡터 및 TF-IDF 인덱스 재구축"""
-        if not self.chunks or not self.embedder:
+        """세션 청크의 벡터 및 TF-IDF 인덱스 재구축 (벌크 인덱스는 재구축하지 않음)"""
+        if not self.embedder:
             return
         
         # 벡터 인덱스 재구축
         print("🔄 벡터 인덱스 재구축 중...")
-        embeddings = self.embedder.encode(self.chunks)
-        dimension = embeddings.shape[1]
-        self.vector_index = faiss.IndexFlatL2(dimension)
-        self.vector_index.add(embeddings.astype('float32'))
+        self._build_vector_index()
         
         # TF-IDF 인덱스 재구축
         print("🔄 TF-IDF 인덱스 재구축 중...")
-        self.tfidf_vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
-        self.tfidf_matrix = self.tfidf_vectorizer.fit_transform(self.chunks)
+        self._build_tfidf_index()
+        
+        # 메타데이터 파티션 재구축
+        self._build_partitions()
         
-        print(f"✅ 인덱스 재구축 완료! (총 {len(self.chunks)}개 청크)")
+        print(f"✅ 인덱스 재구축 완료! (총 {self.bulk_chunk_count + len(self.chunks)}개 청크)")
     
     def get_pdf_summary(self) -> Dict:
         """업로드된 PDF 문서 요약 정보"""
         return {
             'total_pdfs': len(self.pdf_documents),
-            'total_pdf_chunks': sum([doc['chunk_count'] for doc in self.pdf_documents]),
+            'total_pdf_chunks': sum([1 for metadata in self.chunk_metadata if metadata.get('source_type') == 'pdf']),
             'documents': self.pdf_documents
         }
     
+    def get_dedup_summary(self) -> Dict:
+        """근사 중복 병합 효과 요약 (인덱스 축소율, 수집시 절감된 임베딩 시간)"""
+        collapsed_chunks = sum([len(metadata.get('shared_with', [])) for metadata in self.chunk_metadata])
+        input_chunks = len(self.chunks) + collapsed_chunks
+        return {
+            'input_chunks': input_chunks,
+            'indexed_chunks': len(self.chunks),
+            'collapsed_chunks': collapsed_chunks,
+            'shrink_ratio': collapsed_chunks / input_chunks if input_chunks else 0.0,
+            # 임베딩 캐시로 재구축시에는 새 청크만 임베딩하므로, 병합 효과는 수집 시점의 1회성 절감
+            'embedding_seconds_saved': self.embedding_seconds_saved,
+            'embedding_savings_measured': self.pending_collapsed_chunks == 0
+        }
+    
     def remove_pdf_document(self, filename: str) -> bool:
         """특정 PDF 문서 제거"""
         try:
@@ -433,14 +728,36 @@ class SimpleRAGSystem:
             # 해당 PDF의 청크들 제거
             new_chunks = []
             new_metadata = []
+            kept_ids = []
             
-            for chunk, metadata in zip(self.chunks, self.chunk_metadata):
-                if metadata.get('source_type') != 'pdf' or metadata.get('filename') != filename:
-                    new_chunks.append(chunk)
-                    new_metadata.append(metadata)
+            for chunk_id, (chunk, metadata) in enumerate(zip(self.chunks, self.chunk_metadata)):
+                shared_with = [
+                    ref for ref in metadata.get('shared_with', [])
+                    if ref.get('source_type') != 'pdf' or ref.get('filename') != filename
+                ]
+                
+                if metadata.get('source_type') == 'pdf' and metadata.get('filename') == filename:
+                    if not shared_with:
+                        continue
+                    # 다른 문서가 공유하는 청크는 남기고 대표 출처만 교체 (제거된 문서의 출처 필드는 남기지 않음)
+                    metadata = {
+                        **{key: value for key, value in metadata.items() if key not in SOURCE_KEYS},
+                        **shared_with.pop(0)
+                    }
+                
+                metadata = {**metadata, 'shared_with': shared_with}
+                if not shared_with:
+                    del metadata['shared_with']
+                
+                new_chunks.append(chunk)
+                new_metadata.append(metadata)
+                kept_ids.append(chunk_id)
             
             self.chunks = new_chunks
             self.chunk_metadata = new_metadata
+            if self.chunk_embeddings is not None:
+                self.chunk_embeddings = self.chunk_embeddings[kept_ids]
+            self._rebuild_dedup_index()
             
             # PDF 문서 목록에서 제거
             self.pdf_documents = [doc for doc in self.pdf_documents if doc['filename'] != filename]
@@ -0,0 +1,366 @@
+"""
+SFT 데이터 전처리 모듈 (model_tuning.ipynb에서 분리)
+- pack: 여러 예제를 고정 길이 시퀀스로 패킹 (예제 경계 attention 차단 + 예제별 라벨 마스킹)
+- bucket: 패딩 없이 토크나이징 후 길이 버킷 단위로 배치 구성 (배치 내 최장 길이까지만 패딩)
+- padding_report: 기존 padding=True 방식 대비 패딩 비율 비교
+
+CPU 셀프 체크: python sft_data.py
+"""
+
+import random
+import re
+from typing import List, Dict, Optional
+
+import numpy as np
+
+IGNORE_INDEX = -100  # loss 계산에서 제외되는 라벨
+
+
+def format_chat_template(instruction, response):
+    """Llama-2-chat 형식으로 대화 포맷팅"""
+    return f"<s>[INST] {instruction} [/INST] {response} </s>"
+
+
+def tokenize_sft_example(instruction: str, response: str, tokenizer,
+                         max_length: int = 2048, mask_prompt: bool = True) -> Dict:
+    """단일 예제 토크나이징 (패딩 없음)
+    
+    전체 대화 텍스트를 한 번에 토크나이징하고, 프롬프트([INST] ... [/INST])만 토크나이징한 결과와의
+    공통 접두사 길이로 마스킹 구간을 정합니다. 응답을 따로 토크나이징하면 SentencePiece가
+    앞에 불필요한 ▁ 토큰을 붙이므로 학습/추론 토큰열이 달라집니다.
+    """
+    full_ids = tokenizer(format_chat_template(instruction, response), add_special_tokens=False)["input_ids"]
+    prompt_ids = tokenizer(f"<s>[INST] {instruction} [/INST]", add_special_tokens=False)["input_ids"]
+    
+    # 경계에서 토큰이 합쳐지면 프롬프트 단독 결과가 전체의 접두사가 아니므로 일치하는 구간까지만 마스킹
+    prompt_len = 0
+    for full_id, prompt_id in zip(full_ids, prompt_ids):
+        if full_id != prompt_id:
+            break
+        prompt_len += 1
+    
+    input_ids = full_ids[:max_length]
+    labels = list(full_ids)
+    if mask_prompt:
+        labels[:prompt_len] = [IGNORE_INDEX] * prompt_len
+    labels = labels[:max_length]
+    
+    return {'input_ids': input_ids, 'labels': labels, 'length': len(input_ids)}
+
+
+def pack_examples(examples: List[Dict], max_length: int = 2048) -> List[Dict]:
+    """토크나이징된 예제들을 max_length 이하 시퀀스로 패킹 (First-Fit Decreasing)
+    
+    - 예제는 쪼개지지 않음 (한 예제는 한 시퀀스에만 속함)
+    - position_ids는 예제마다 0부터 다시 시작
+    - 각 예제의 첫 토큰 라벨은 IGNORE_INDEX (앞 예제의 마지막 토큰으로 다음 예제를 예측하지 않음)
+    """
+    order = sorted(range(len(examples)), key=lambda i: examples[i]['length'], reverse=True)
+    bins: List[List[int]] = []
+    bin_lengths: List[int] = []
+    
+    for idx in order:
+        length = examples[idx]['length']
+        for b, used in enumerate(bin_lengths):
+            if used + length <= max_length:
+                bins[b].append(idx)
+                bin_lengths[b] += length
+                break
+        else:
+            bins.append([idx])
+            bin_lengths.append(length)
+    
+    packed = []
+    for members in bins:
+        input_ids, labels, position_ids, seq_lens = [], [], [], []
+        for idx in members:
+            example = examples[idx]
+            input_ids.extend(example['input_ids'])
+            labels.extend([IGNORE_INDEX] + example['labels'][1:])
+            position_ids.extend(range(example['length']))
+            seq_lens.append(example['length'])
+        packed.append({
+            'input_ids': input_ids,
+            'labels': labels,
+            'position_ids': position_ids,
+            'seq_lens': seq_lens,
+            'length': len(input_ids)
+        })
+    
+    return packed
+
+
+def length_bucketed_batches(lengths: List[int], batch_size: int,
+                            mega_batch_mult: int = 50, seed: int = 42) -> List[List[int]]:
+    """길이가 비슷한 예제끼리 배치 구성 (transformers LengthGroupedSampler와 같은 방식)
+    
+    셔플 후 batch_size * mega_batch_mult 크기의 메가 배치 안에서 길이순 정렬하여
+    무작위성을 유지하면서 배치 내 길이 편차를 줄입니다.
+    """
+    indices = list(range(len(lengths)))
+    random.Random(seed).shuffle(indices)
+    
+    mega_batch_size = batch_size * mega_batch_mult
+    batches = []
+    for start in range(0, len(indices), mega_batch_size):
+        mega_batch = sorted(indices[start:start + mega_batch_size], key=lambda i: lengths[i], reverse=True)
+        batches.extend(mega_batch[i:i + batch_size] for i in range(0, len(mega_batch), batch_size))
+    
+    return batches
+
+
+def padding_ratio(batches: List[List[int]], lengths: List[int],
+                  pad_to_multiple_of: int = 1, pad_lengths: Optional[List[int]] = None) -> float:
+    """배치별로 최장 길이까지 패딩했을 때 전체 토큰 중 패딩 비율
+    
+    pad_lengths가 주어지면 예제별로 이미 패딩된 길이를 사용합니다 (tokenize 단계 padding=True).
+    """
+    real_tokens, total_tokens = 0, 0
+    for batch in batches:
+        if pad_lengths is not None:
+            padded = max(pad_lengths[i] for i in batch)
+        else:
+            padded = max(lengths[i] for i in batch)
+        padded = -(-padded // pad_to_multiple_of) * pad_to_multiple_of
+        real_tokens += sum(lengths[i] for i in batch)
+        total_tokens += padded * len(batch)
+    return 1 - real_tokens / total_tokens if total_tokens else 0.0
+
+
+def padding_report(lengths: List[int], batch_size: int = 1, max_length: int = 2048,
+                   map_batch_size: int = 1000, pad_to_multiple_of: int = 8) -> Dict:
+    """기존(padding=True) / bucket / pack 방식의 패딩 비율 비교
+    
+    기존 방식은 dataset.map(batched=True)의 map 배치(기본 1000개)마다 최장 길이로 패딩되므로
+    학습 배치 크기와 무관하게 그 길이만큼 토큰을 소비합니다.
+    """
+    lengths = [min(length, max_length) for length in lengths]
+    sequential = [list(range(i, min(i + batch_size, len(lengths)))) for i in range(0, len(lengths), batch_size)]
+    
+    # 기존: map 배치 단위 padding=True
+    pad_lengths = [0] * len(lengths)
+    for start in range(0, len(lengths), map_batch_size):
+        longest = max(lengths[start:start + map_batch_size])
+        for i in range(start, min(start + map_batch_size, len(lengths))):
+            pad_lengths[i] = longest
+    
+    # pack: 패킹된 시퀀스를 하나의 예제로 보고 배치
+    packed = pack_examples(
+        [{'input_ids': [0] * length, 'labels': [0] * length, 'length': length} for length in lengths],
+        max_length
+    )
+    packed_lengths = [sequence['length'] for sequence in packed]
+    packed_batches = [list(range(i, min(i + batch_size, len(packed)))) for i in range(0, len(packed), batch_size)]
+    
+    return {
+        'examples': len(lengths),
+        'before_padding_ratio': padding_ratio(sequential, lengths, pad_lengths=pad_lengths),
+        'bucket_padding_ratio': padding_ratio(
+            length_bucketed_batches(lengths, batch_size), lengths, pad_to_multiple_of
+        ),
+        'pack_padding_ratio': padding_ratio(packed_batches, packed_lengths, pad_to_multiple_of),
+        'packed_sequences': len(packed)
+    }
+
+
+def print_padding_report(report: Dict, dataset_name: str = ""):
+    """패딩 비율 리포트 출력"""
+    print(f"\n📊 {dataset_name} 패딩 비율 ({report['examples']}개 예제):")
+    print(f"   기존 (padding=True): {report['before_padding_ratio'] * 100:.1f}%")
+    print(f"   bucket: {report['bucket_padding_ratio'] * 100:.1f}%")
+    print(f"   pack: {report['pack_padding_ratio'] * 100:.1f}% ({report['packed_sequences']}개 시퀀스)")
+
+
+def block_causal_mask(seq_lens_batch: List[List[int]], max_len: int) -> np.ndarray:
+    """패킹된 배치의 블록 대각 causal mask (batch, max_len, max_len), True = 참조 가능
+    
+    같은 예제 안에서만, 이전 토큰만 참조합니다 (패딩 위치는 자기 자신만 참조해 NaN 방지).
+    """
+    segment_ids = np.full((len(seq_lens_batch), max_len), -1)
+    for row, seq_lens in enumerate(seq_lens_batch):
+        offset = 0
+        for segment, seq_len in enumerate(seq_lens):
+            segment_ids[row, offset:offset + seq_len] = segment
+            offset += seq_len
+    
+    causal = np.tril(np.ones((max_len, max_len), dtype=bool))
+    same_segment = segment_ids[:, :, None] == segment_ids[:, None, :]
+    return (same_segment & (segment_ids[:, :, None] >= 0) & causal) | np.eye(max_len, dtype=bool)
+
+
+class PackedDataCollator:
+    """패킹된 시퀀스용 콜레이터
+    
+    예제 경계를 넘지 않는 블록 대각 causal mask(4D, additive)와 예제별 position_ids를 생성합니다.
+    """
+    
+    def __init__(self, pad_token_id: int, dtype=None, pad_to_multiple_of: int = 8):
+        self.pad_token_id = pad_token_id
+        self.dtype = dtype
+        self.pad_to_multiple_of = pad_to_multiple_of
+    
+    def __call__(self, features: List[Dict]) -> Dict:
+        import torch
+        
+        dtype = self.dtype or torch.bfloat16
+        max_len = max(len(f['input_ids']) for f in features)
+        max_len = -(-max_len // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        batch_size = len(features)
+        
+        input_ids = torch.full((batch_size, max_len), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((batch_size, max_len), IGNORE_INDEX, dtype=torch.long)
+        position_ids = torch.zeros((batch_size, max_len), dtype=torch.long)
+        
+        for row, feature in enumerate(features):
+            length = len(feature['input_ids'])
+            input_ids[row, :length] = torch.tensor(feature['input_ids'])
+            labels[row, :length] = torch.tensor(feature['labels'])
+            position_ids[row, :length] = torch.tensor(feature['position_ids'])
+        
+        allowed = torch.from_numpy(block_causal_mask([f['seq_lens'] for f in features], max_len))
+        
+        attention_mask = torch.zeros((batch_size, 1, max_len, max_len), dtype=dtype)
+        attention_mask.masked_fill_(~allowed[:, None, :, :], torch.finfo(dtype).min)
+        
+        return {
+            'input_ids': input_ids,
+            'labels': labels,
+            'position_ids': position_ids,
+            'attention_mask': attention_mask
+        }
+
+
+def prepare_sft_dataset_advanced(dataset, tokenizer, max_length=2048, mode="bucket", mask_prompt=True):
+    """
+    고급 SFT 데이터 전처리:
+    - 2048 토큰까지 활용
+    - mode="bucket": 패딩 없이 토크나이징 (length 컬럼으로 group_by_length 배치, 배치 내 동적 패딩)
+    - mode="pack": 여러 예제를 max_length 시퀀스로 패킹
+    - 프롬프트 구간 라벨 마스킹 (mask_prompt=True)
+    """
+    from datasets import Dataset
+    
+    def tokenize_function(examples):
+        tokenized = {'input_ids': [], 'labels': [], 'length': []}
+        for instruction, response in zip(examples['instruction'], examples['response']):
+            example = tokenize_sft_example(instruction, response, tokenizer, max_length, mask_prompt)
+            for key in tokenized:
+                tokenized[key].append(example[key])
+        return tokenized
+    
+    tokenized_dataset = dataset.map(
+        tokenize_function,
+        batched=True,
+        remove_columns=dataset.column_names,
+        desc=f"Tokenizing dataset (max_length={max_length}, mode={mode})",
+        num_proc=4  # 멀티프로세싱으로 속도 향상
+    )
+    
+    if mode == "pack":
+        packed = pack_examples(list(tokenized_dataset), max_length)
+        return Dataset.from_list(packed)
+    if mode == "bucket":
+        return tokenized_dataset
+    raise ValueError(f"지원하지 않는 mode입니다: {mode}")
+
+
+def build_data_collator(tokenizer, mode="bucket", dtype=None):
+    """mode에 맞는 데이터 콜레이터 생성 (라벨 마스킹 유지)"""
+    if mode == "pack":
+        return PackedDataCollator(tokenizer.pad_token_id, dtype=dtype)
+    
+    # DataCollatorForLanguageModeling은 labels를 input_ids로 덮어쓰므로 Seq2Seq 콜레이터 사용
+    from transformers import DataCollatorForSeq2Seq
+    seq2seq_collator = DataCollatorForSeq2Seq(
+        tokenizer=tokenizer,
+        label_pad_token_id=IGNORE_INDEX,
+        pad_to_multiple_of=8,
+        return_tensors="pt"
+    )
+    
+    def collate(features):
+        # length 컬럼은 group_by_length 샘플러용이므로 모델 입력에서 제외
+        return seq2seq_collator([
+            {key: value for key, value in feature.items() if key != 'length'}
+            for feature in features
+        ])
+    
+    return collate
+
+
+def _self_check():
+    """CPU 전용 셀프 체크 (모델/GPU 없이 간단한 토크나이저로 검증)"""
+    
+    class SentencePieceLikeTokenizer:
+        """Llama SentencePiece처럼 맨 앞에 ▁를 붙이고 공백을 ▁로 바꿔 단어 단위로 자르는 토크나이저"""
+        pad_token_id = 0
+        
+        def __init__(self):
+            self.vocab = {}
+        
+        def __call__(self, text, add_special_tokens=False):
+            pieces = re.findall(r"▁[^▁]*", "▁" + text.replace(" ", "▁"))
+            return {'input_ids': [self.vocab.setdefault(piece, len(self.vocab) + 1) for piece in pieces]}
+    
+    rng = random.Random(0)
+    tokenizer = SentencePieceLikeTokenizer()
+    pairs = [
+        (
+            " ".join("q" * rng.randint(1, 5) for _ in range(rng.randint(3, 20))),
+            " ".join("a" * rng.randint(1, 5) for _ in range(rng.randint(5, 300)))
+        )
+        for _ in range(200)
+    ]
+    examples = [tokenize_sft_example(instruction, response, tokenizer, max_length=256) for instruction, response in pairs]
+    
+    # 토큰열: 프롬프트 + 응답 = 전체 텍스트 토크나이징 (응답 앞 ▁ 토큰이 끼지 않음)
+    # 라벨 마스킹: 프롬프트 구간만 IGNORE_INDEX
+    for (instruction, response), example in zip(pairs, examples):
+        full_ids = tokenizer(format_chat_template(instruction, response))['input_ids']
+        prompt_ids = tokenizer(f"<s>[INST] {instruction} [/INST]")['input_ids']
+        prompt_len = len(prompt_ids)
+        assert example['input_ids'] == full_ids[:256]
+        assert example['input_ids'][:prompt_len] == prompt_ids
+        assert example['labels'][:prompt_len] == [IGNORE_INDEX] * prompt_len
+        assert example['labels'][prompt_len:] == full_ids[prompt_len:256]
+        assert len(example['input_ids']) == len(example['labels']) <= 256
+    
+    # 패킹: 모든 예제가 정확히 한 번씩, 쪼개지지 않고 들어감
+    packed = pack_examples(examples, max_length=256)
+    assert sum(len(sequence['seq_lens']) for sequence in packed) == len(examples)
+    assert sorted(l for sequence in packed for l in sequence['seq_lens']) == sorted(e['length'] for e in examples)
+    for sequence in packed:
+        assert sequence['length'] <= 256
+        offset = 0
+        for seq_len in sequence['seq_lens']:
+            assert sequence['position_ids'][offset] == 0
+            assert sequence['labels'][offset] == IGNORE_INDEX
+            offset += seq_len
+    
+    # 버킷 배치: 모든 예제가 정확히 한 번씩
+    lengths = [example['length'] for example in examples]
+    batches = length_bucketed_batches(lengths, batch_size=4)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(examples)))
+    
+    # 콜레이터 attention mask: 위치쌍을 하나씩 확인한 결과와 일치 (예제 경계를 넘지 않음)
+    multi = [sequence for sequence in packed if len(sequence['seq_lens']) > 1][:2]
+    assert multi
+    max_len = -(-max(sequence['length'] for sequence in multi) // 8) * 8
+    mask = block_causal_mask([sequence['seq_lens'] for sequence in multi], max_len)
+    for row, sequence in enumerate(multi):
+        segments = [segment for segment, seq_len in enumerate(sequence['seq_lens']) for _ in range(seq_len)]
+        segments += [-1] * (max_len - len(segments))
+        for i in range(max_len):
+            for j in range(max_len):
+                expected = i == j or (j < i and segments[i] >= 0 and segments[i] == segments[j])
+                assert mask[row, i, j] == expected
+    
+    report = padding_report(lengths, batch_size=4, max_length=256)
+    print_padding_report(report, "셀프 체크")
+    assert report['bucket_padding_ratio'] <= report['before_padding_ratio']
+    assert report['pack_padding_ratio'] <= report['before_padding_ratio']
+    print("✅ sft_data 셀프 체크 통과")
+
+
+if __name__ == "__main__":
+    _self_check()
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""
+샤딩된 벡터/키워드 검색 인덱스
+- 청크를 연속 구간 N개로 나누어 샤드별 FAISS 인덱스 + TF-IDF 행렬 보관
+- 질의는 스레드 풀로 샤드에 분산 (FAISS/SciPy 연산은 GIL 해제)
+- 샤드별 부분 결과는 힙 기반 k-way 병합으로 전역 top-k 산출
+"""
+
+import os
+import heapq
+import itertools
+import faiss
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.preprocessing import normalize
+from typing import List, Tuple, Optional
+
+SHARD_MIN_CHUNKS = 50000  # 자동 샤딩시 샤드당 최소 청크 수
+
+
+class _Shard:
+    """전역 청크 ID [start, end) 구간을 담당하는 샤드"""
+    
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.vector_index = None
+        self.tfidf_matrix = None
+        self.tfidf_vectorizer = None  # tfidf_matrix를 만든 벡터라이저 (질의도 같은 어휘/IDF로 변환)
+    
+    def _local_ids(self, candidate_ids: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """정렬된 전역 후보 ID 중 이 샤드 구간에 속하는 것을 로컬 ID로 변환"""
+        if candidate_ids is None:
+            return None
+        lo, hi = np.searchsorted(candidate_ids, [self.start, self.end])
+        return candidate_ids[lo:hi] - self.start
+    
+    def vector_search(self, query_embedding: np.ndarray, k: int,
+                      candidate_ids: Optional[np.ndarray]) -> List[Tuple[float, int]]:
+        """(거리, 전역 ID) 목록을 거리 오름차순으로 반환"""
+        local_ids = self._local_ids(candidate_ids)
+        
+        if local_ids is None:
+            distances, indices = self.vector_index.search(query_embedding, min(k, self.end - self.start))
+        elif len(local_ids) == 0:
+            return []
+        else:
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(local_ids))
+            distances, indices = self.vector_index.search(
+                query_embedding, min(k, len(local_ids)), params=params
+            )
+        
+        return [
+            (float(distance), int(idx) + self.start)
+            for distance, idx in zip(distances[0], indices[0]) if idx >= 0
+        ]
+    
+    def keyword_search(self, query_vector, k: int,
+                       candidate_ids: Optional[np.ndarray]) -> List[Tuple[float, int]]:
+        """(유사도, 전역 ID) 목록을 유사도 내림차순으로 반환
+        
+        TfidfVectorizer 행은 이미 L2 정규화되어 있으므로 희소 행렬 곱이 곧 코사인 유사도입니다
+        (cosine_similarity처럼 질의마다 샤드 행렬 전체를 정규화한 사본을 만들지 않음).
+        query_vector는 ShardedIndex.keyword_search에서 이 샤드의 벡터라이저로 변환/정규화되어 전달됩니다.
+        """
+        local_ids = self._local_ids(candidate_ids)
+        
+        if local_ids is None:
+            matrix = self.tfidf_matrix
+            local_ids = np.arange(self.end - self.start)
+        elif len(local_ids) == 0:
+            return []
+        else:
+            matrix = self.tfidf_matrix[local_ids]
+        
+        similarities = (matrix @ query_vector.T).toarray().ravel()
+        
+        # 상위 k개 인덱스 (큰 샤드에서는 전체 정렬 대신 argpartition)
+        if len(similarities) > k:
+            top_positions = np.argpartition(similarities, -k)[-k:]
+        else:
+            top_positions = np.arange(len(similarities))
+        top_positions = top_positions[np.argsort(similarities[top_positions])[::-1]]
+        
+        return [
+            (float(similarities[pos]), int(local_ids[pos]) + self.start)
+            for pos in top_positions
+        ]
+
+
+class ShardedIndex:
+    """샤드별 벡터/키워드 인덱스와 병렬 top-k 검색
+    
+    num_shards가 None이면 RAG_NUM_SHARDS 환경 변수를 사용하고, 그것도 없으면
+    청크 수에 따라 자동 결정합니다 (SHARD_MIN_CHUNKS개당 1샤드, 최대 CPU 코어 수).
+    
+    base가 주어지면 base의 샤드를 읽기 전용으로 함께 검색하고, 이 인덱스의 샤드는
+    base 이후 ID 구간(예: 세션별 PDF 청크)만 담당합니다. 이때 RAG_NUM_SHARDS는 base에만 적용됩니다.
+    """
+    
+    def __init__(self, num_shards: Optional[int] = None, base: Optional['ShardedIndex'] = None):
+        if num_shards is None and base is None and os.environ.get("RAG_NUM_SHARDS"):
+            num_shards = int(os.environ["RAG_NUM_SHARDS"])
+        self.num_shards = num_shards
+        self.base_shards: List[_Shard] = list(base.shards) if base is not None else []
+        self.shards: List[_Shard] = []
+        self._executor = None
+        self._executor_workers = 0
+    
+    def _shard_count(self, num_chunks: int) -> int:
+        if self.num_shards is not None:
+            count = self.num_shards
+        else:
+            count = min(os.cpu_count() or 1, num_chunks // SHARD_MIN_CHUNKS)
+        return max(1, min(count, num_chunks))
+    
+    def build_vectors(self, embeddings: np.ndarray, start: int = 0):
+        """임베딩(전역 ID start부터)을 구간별로 나누어 샤드 벡터 인덱스 구축"""
+        num_chunks = len(embeddings)
+        if num_chunks == 0:
+            self.shards = []
+            self._ensure_executor()
+            return
+        
+        dimension = embeddings.shape[1]
+        edges = start + np.linspace(0, num_chunks, self._shard_count(num_chunks) + 1).astype(int)
+        self.shards = [_Shard(int(lo), int(hi)) for lo, hi in zip(edges[:-1], edges[1:])]
+        
+        for shard in self.shards:
+            shard.vector_index = faiss.IndexFlatL2(dimension)
+            shard.vector_index.add(embeddings[shard.start - start:shard.end - start].astype('float32'))
+        
+        self._ensure_executor()
+    
+    def _ensure_executor(self):
+        """검색할 샤드 수만큼 스레드 풀 준비 (샤드가 하나면 만들지 않음)"""
+        total_shards = len(self.base_shards) + len(self.shards)
+        if total_shards > max(1, self._executor_workers):
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = ThreadPoolExecutor(max_workers=total_shards, thread_name_prefix="rag-shard")
+            self._executor_workers = total_shards
+    
+    def build_keywords(self, tfidf_matrix, tfidf_vectorizer=None):
+        """이 인덱스의 청크로 학습한 TF-IDF 행렬을 샤드 구간별로 분할 (IDF/어휘는 샤드 간 동일)
+        
+        base 샤드는 base를 만들 때의 벡터라이저를 그대로 유지하므로, 세션 청크는 자체 어휘로
+        학습해도 base를 다시 학습/구축할 필요가 없습니다.
+        """
+        num_rows = 0 if tfidf_matrix is None else tfidf_matrix.shape[0]
+        indexed_rows = self.shards[-1].end - self.shards[0].start if self.shards else 0
+        if indexed_rows != num_rows:
+            raise ValueError("벡터 인덱스와 TF-IDF 행렬의 청크 수가 다릅니다.")
+        offset = self.shards[0].start if self.shards else 0
+        for shard in self.shards:
+            shard.tfidf_matrix = tfidf_matrix[shard.start - offset:shard.end - offset]
+            shard.tfidf_vectorizer = tfidf_vectorizer
+    
+    def _fan_out(self, search_fn) -> List[List[Tuple[float, int]]]:
+        """base 샤드 + 자체 샤드 모두에 검색 분산 (샤드가 하나면 호출 스레드에서 실행)"""
+        shards = self.base_shards + self.shards
+        if len(shards) == 1 or self._executor is None:
+            return [search_fn(shard) for shard in shards]
+        return list(self._executor.map(search_fn, shards))
+    
+    def vector_search(self, query_embedding: np.ndarray, k: int,
+                      candidate_ids: Optional[np.ndarray] = None) -> List[Tuple[float, int]]:
+        """전역 top-k (거리, 청크 ID), 거리 오름차순"""
+        partials = self._fan_out(lambda shard: shard.vector_search(query_embedding, k, candidate_ids))
+        return list(itertools.islice(heapq.merge(*partials), k))
+    
+    def keyword_search(self, query: str, k: int,
+                       candidate_ids: Optional[np.ndarray] = None) -> List[Tuple[float, int]]:
+        """전역 top-k (유사도, 청크 ID), 유사도 내림차순
+        
+        질의는 벡터라이저별로 한 번씩만 변환합니다 (base 샤드와 자체 샤드의 어휘가 다를 수 있음).
+        """
+        query_vectors = {}
+        for shard in self.base_shards + self.shards:
+            vectorizer = shard.tfidf_vectorizer
+            if id(vectorizer) not in query_vectors:
+                # 질의 벡터만 정규화 (행렬 행은 이미 L2 정규화됨)
+                query_vectors[id(vectorizer)] = normalize(vectorizer.transform([query]))
+        
+        partials = self._fan_out(
+            lambda shard: shard.keyword_search(query_vectors[id(shard.tfidf_vectorizer)], k, candidate_ids)
+        )
+        return list(itertools.islice(heapq.merge(*partials, key=lambda x: -x[0]), k))
\ No newline at end of file
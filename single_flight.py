@@ -0,0 +1,169 @@
+"""
+동일 요청 병합 (single-flight) 레이어
+- 동시에 들어온 같은 프롬프트/생성 파라미터 요청은 업스트림 호출 하나를 공유
+"""
+
+import hashlib
+import json
+import threading
+from typing import List, Dict, Iterator, Optional
+from api_client import VLLMAPIClient
+
+
+class _InFlightCall:
+    """진행 중인 업스트림 호출 상태"""
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.tokens: List[str] = []
+        self.result: Optional[str] = None
+        self.done = False
+    
+    def append(self, token: str):
+        """스트리밍 토큰 추가"""
+        with self.condition:
+            self.tokens.append(token)
+            self.condition.notify_all()
+    
+    def finish(self, result: str):
+        """호출 완료 처리 (대기 중인 요청 모두 깨움)"""
+        with self.condition:
+            self.result = result
+            if not self.tokens:
+                # 비스트리밍 호출에 스트리밍 요청이 합류한 경우 결과 전체를 한 번에 전달
+                self.tokens.append(result)
+            self.done = True
+            self.condition.notify_all()
+    
+    def wait_result(self) -> str:
+        """완료될 때까지 대기 후 최종 결과 반환"""
+        with self.condition:
+            while not self.done:
+                self.condition.wait()
+            return self.result
+    
+    def replay(self) -> Iterator[str]:
+        """이미 생성된 토큰부터 재생하고 이후 토큰을 이어서 전달"""
+        position = 0
+        while True:
+            with self.condition:
+                while position >= len(self.tokens) and not self.done:
+                    self.condition.wait()
+                new_tokens = self.tokens[position:]
+                done = self.done
+            position += len(new_tokens)
+            for token in new_tokens:
+                yield token
+            if done:
+                return
+
+
+class SingleFlightClient:
+    """VLLMAPIClient 앞단의 요청 병합 레이어
+    
+    진행 중인 호출 목록은 클래스 단위로 공유되므로, Streamlit 세션마다
+    인스턴스를 따로 만들어도 같은 프로세스 안에서는 병합됩니다.
+    완료된 호출은 즉시 목록에서 제거됩니다 (캐시가 아님).
+    """
+    
+    _in_flight: Dict[str, _InFlightCall] = {}
+    _lock = threading.Lock()
+    stats = {'upstream_calls': 0, 'coalesced_calls': 0}
+    
+    def __init__(self, api_client: VLLMAPIClient):
+        self.api_client = api_client
+    
+    def __getattr__(self, name):
+        # health_check, count_tokens 등은 원본 클라이언트에 위임
+        return getattr(self.api_client, name)
+    
+    @staticmethod
+    def _normalize(text: str) -> str:
+        """공백 차이를 무시하도록 프롬프트 정규화"""
+        return " ".join(text.split())
+    
+    def _request_key(self, messages: List[Dict[str, str]], params: Dict) -> str:
+        """정규화된 메시지 + 생성 파라미터 기반 요청 키"""
+        payload = {
+            'base_url': self.api_client.base_url,
+            'messages': [
+                {'role': m['role'], 'content': self._normalize(m['content'])}
+                for m in messages
+            ],
+            'params': params
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def _join(self, key: str):
+        """진행 중인 호출에 합류하거나 새 호출의 리더가 됨"""
+        with self._lock:
+            call = self._in_flight.get(key)
+            if call is not None:
+                self.stats['coalesced_calls'] += 1
+                print(f"🔗 동일 요청 병합: {key[:12]}")
+                return call, False
+            
+            call = _InFlightCall()
+            self._in_flight[key] = call
+            self.stats['upstream_calls'] += 1
+            return call, True
+    
+    def _complete(self, key: str, call: _InFlightCall, result: str):
+        """호출 완료 후 목록에서 제거"""
+        with self._lock:
+            if self._in_flight.get(key) is call:
+                del self._in_flight[key]
+        call.finish(result)
+    
+    def chat_completion(self, messages: List[Dict[str, str]], **params) -> str:
+        """병합된 채팅 완성 호출"""
+        key = self._request_key(messages, params)
+        call, is_leader = self._join(key)
+        
+        if not is_leader:
+            return call.wait_result()
+        
+        result = "오류: 업스트림 호출 실패"
+        try:
+            result = self.api_client.chat_completion(messages, **params)
+        finally:
+            self._complete(key, call, result)
+        return result
+    
+    def chat_completion_stream(self, messages: List[Dict[str, str]], **params) -> Iterator[str]:
+        """병합된 스트리밍 호출 (늦게 합류한 요청은 생성된 토큰부터 재생)"""
+        key = self._request_key(messages, params)
+        call, is_leader = self._join(key)
+        
+        if is_leader:
+            # 업스트림 스트림은 별도 스레드가 소비하므로 리더가 중간에 끊겨도 합류자는 계속 받음
+            thread = threading.Thread(
+                target=self._run_stream, args=(key, call, messages, params), daemon=True
+            )
+            thread.start()
+        
+        return call.replay()
+    
+    def _run_stream(self, key: str, call: _InFlightCall,
+                    messages: List[Dict[str, str]], params: Dict):
+        """업스트림 스트림을 소비하며 토큰을 공유 버퍼에 기록"""
+        try:
+            for token in self.api_client.chat_completion_stream(messages, **params):
+                call.append(token)
+        finally:
+            self._complete(key, call, "".join(call.tokens))
+    
+    def simple_chat(self, user_message: str, system_message: str = "답변하세요.") -> str:
+        """간단한 채팅 (병합)"""
+        messages = [
+            {"role": "user", "content": user_message}
+        ]
+        return self.chat_completion(messages)
+    
+    def simple_chat_stream(self, user_message: str) -> Iterator[str]:
+        """간단한 스트리밍 채팅 (병합)"""
+        messages = [
+            {"role": "user", "content": user_message}
+        ]
+        return self.chat_completion_stream(messages)
\ No newline at end of file
@@ -83,6 +83,7 @@ echo "   - 포트: 8000"
 echo "   - GPU 메모리 사용률: 70% (0.7)"
 echo "   - 최대 토큰: 2048"
 echo "   - 최대 동시 시퀀스: 32개"
+echo "   - Prefix caching: 활성화 (RAG 프롬프트 접두사 재사용)"
 echo "   - CORS: 기본 설정"
 
 # 포트 사용 확인
@@ -114,6 +115,7 @@ python -m vllm.entrypoints.openai.api_server \
     --max-num-seqs 32 \
     --swap-space 2 \
     --enable-chunked-prefill \
+    --enable-prefix-caching \
     --max-num-batched-tokens 2048
 
 echo "\n🏁 VLLM 서버가 종료되었습니다."
\ No newline at end of file
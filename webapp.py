@@ -131,6 +131,24 @@ def main():
                 help="Hybrid: 의미적 + 키워드 검색 결합"
             )
             
+            # 검색 범위 선택 (메타데이터 파티션 필터)
+            pdf_filenames = [doc['filename'] for doc in st.session_state.rag_system.pdf_documents]
+            search_scope = st.selectbox(
+                "검색 범위",
+                ["전체", "기본 데이터", "PDF 전체"] + pdf_filenames,
+                index=0,
+                help="선택한 문서/소스의 청크 안에서만 검색합니다"
+            )
+            
+            if search_scope == "기본 데이터":
+                filters = {'source_type': 'basic'}
+            elif search_scope == "PDF 전체":
+                filters = {'source_type': 'pdf'}
+            elif search_scope in pdf_filenames:
+                filters = {'filename': search_scope}
+            else:
+                filters = None
+            
             # 질문 입력
             query = st.text_area(
                 "질문을 입력하세요:",
@@ -142,12 +160,15 @@ def main():
                 if query.strip():
                     with st.spinner("답변 생성 중..."):
                         answer, docs = st.session_state.rag_system.generate_answer(
-                            query, search_method
+                            query, search_method, filters, stream=True
                         )
                         
-                        # 답변 표시
+                        # 답변 표시 (토큰 단위 스트리밍, 오류 메시지는 문자열로 반환됨)
                         st.subheader("🤖 AI 답변")
-                        st.write(answer)
+                        if isinstance(answer, str):
+                            st.write(answer)
+                        else:
+                            st.write_stream(answer)
                         
                         # 참고 문서들
                         if docs:
@@ -161,6 +182,9 @@ def main():
                                         st.markdown(f"**📄 PDF 문서 {i+1}** (유사도: {doc['score']:.3f})")
                                         st.markdown(f"*파일명: {metadata.get('filename', 'Unknown')}*")
                                         st.markdown(f"*업로드: {metadata.get('upload_time', 'Unknown')}*")
+                                        shared_files = sorted({ref['filename'] for ref in metadata.get('shared_with', []) if 'filename' in ref})
+                                        if shared_files:
+                                            st.markdown(f"*동일 내용 포함 문서: {', '.join(shared_files)}*")
                                     else:
                                         # 기본 데이터인 경우
                                         st.markdown(f"**📚 기본 문서 {i+1}** (유사도: {doc['score']:.3f})")
@@ -231,9 +255,22 @@ def main():
                 with col2:
                     st.metric("총 청크 수", pdf_summary['total_pdf_chunks'])
                 with col3:
-                    basic_chunks = len(st.session_state.rag_system.chunks) - pdf_summary['total_pdf_chunks']
+                    rag_system = st.session_state.rag_system
+                    basic_chunks = rag_system.bulk_chunk_count + len(rag_system.chunks) - pdf_summary['total_pdf_chunks']
                     st.metric("기본 데이터 청크", basic_chunks)
                 
+                # 근사 중복 병합 효과
+                dedup_summary = st.session_state.rag_system.get_dedup_summary()
+                if dedup_summary['collapsed_chunks'] > 0:
+                    savings = (
+                        f", 수집시 임베딩 약 {dedup_summary['embedding_seconds_saved']:.2f}초 절감"
+                        if dedup_summary['embedding_savings_measured'] else ""
+                    )
+                    st.caption(
+                        f"🧬 근사 중복 청크 {dedup_summary['collapsed_chunks']}개 병합 "
+                        f"(인덱스 {dedup_summary['shrink_ratio']*100:.1f}% 축소{savings})"
+                    )
+                
                 st.divider()
                 
                 # PDF 문서 목록
@@ -244,6 +281,8 @@ def main():
                         with info_col1:
                             st.text(f"업로드 시간: {doc['upload_time']}")
                             st.text(f"청크 수: {doc['chunk_count']}개")
+                            if doc.get('collapsed_count'):
+                                st.text(f"근사 중복 병합: {doc['collapsed_count']}개")
                         
                         with info_col2:
                             st.text(f"텍스트 길이: {len(doc['text']):,}자")